@@ -0,0 +1,180 @@
+# bench.py
+# Offline benchmark for the strategy checks: no network, Telegram or RPC.
+# Alerts are collected through main.ALERT_SINK and DEX prices are synthesized
+# around the CEX price instead of quoting routers.
+#
+#   python bench.py --exchanges 3,10,20 --symbols 500,2000,10000
+#   python bench.py --snapshot recorded.json.gz --repeat 20
+#   python bench.py --exchanges 5 --symbols 1000 --save snap.json.gz
+import os
+import sys
+import gzip
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+os.environ.setdefault("TELEGRAM_TOKEN", "0:bench")  # main builds a Bot at import, never used here
+import main
+
+def synthetic_snapshot(n_ex: int, n_sym: int, seed: int = 1, listing: float = 0.7) -> dict:
+    # {"tickers": {ex: {sym: ticker}}, "funding": {ex: {perp: {"fundingRate": r}}}}
+    rng = np.random.default_rng(seed)
+    base = np.exp(rng.normal(0.0, 3.0, n_sym))
+    tickers: Dict[str, Dict[str, dict]] = {}
+    funding: Dict[str, Dict[str, dict]] = {}
+    for j in range(n_ex):
+        ex = f"ex{j:02d}"
+        listed = rng.random(n_sym) < listing
+        mid = base * (1 + rng.normal(0.0, 0.01, n_sym))
+        half = mid * rng.uniform(0.0002, 0.003, n_sym)
+        qvol = np.exp(rng.normal(13.5, 1.5, n_sym))
+        rates = rng.normal(0.0001, 0.0004, n_sym)
+        tks = {}
+        fr = {}
+        for i in np.flatnonzero(listed):
+            sym = f"S{i}/USDT"
+            tks[sym] = {"symbol": sym, "bid": float(mid[i] - half[i]), "ask": float(mid[i] + half[i]), "last": float(mid[i]),
+                        "quoteVolume": float(qvol[i]), "baseVolume": float(qvol[i] / mid[i])}
+            fr[f"S{i}/USDT:USDT"] = {"fundingRate": float(rates[i])}
+        tickers[ex] = tks
+        funding[ex] = fr
+    return {"tickers": tickers, "funding": funding}
+
+def load_snapshot(path: str) -> dict:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        snap = json.load(f)
+    if "tickers" not in snap:
+        # bare {exchange: {symbol: ticker}} dump
+        snap = {"tickers": snap}
+    snap.setdefault("funding", {})
+    return snap
+
+def save_snapshot(snap: dict, path: str):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wt", encoding="utf-8") as f:
+        json.dump(snap, f)
+
+def install_stubs(snap: dict, seed: int) -> List[Tuple[str, Optional[str]]]:
+    sent: List[Tuple[str, Optional[str]]] = []
+    # fresh symbol interning, so a store is sized by this snapshot alone
+    main.SYMBOL_IDS.clear()
+    main.SYMBOLS.clear()
+    main.ALERT_SINK = lambda text, key: sent.append((text, key))
+    main.DEPTH_CHECK = False  # order books would need the network
+    rng = np.random.default_rng(seed)
+    skew: Dict[str, float] = {}
+
+    async def quote_dex_prices(session, syms, ref_prices, buy=False):
+        # a few percent off the CEX reference, stable per symbol across iterations; buying
+        # out of the pool costs a pool fee more than selling into it
+        out = {}
+        for sym in syms:
+            ref = ref_prices.get(sym)
+            if ref:
+                if sym not in skew:
+                    skew[sym] = float(rng.normal(0.0, 0.03))
+                out[sym] = ref * (1 + skew[sym]) * (1.006 if buy else 1.0)
+        return out
+    main.quote_dex_prices = quote_dex_prices
+    for name in snap["tickers"]:
+        main.ENABLED_EXCHANGES[name] = True
+    return sent
+
+def run_check(loop: asyncio.AbstractEventLoop, name: str, store: dict, funding: dict) -> None:
+    # on a loop the benchmark keeps open: asyncio.run() per call would time loop setup too
+    if name == "cex_cex":
+        loop.run_until_complete(main.check_cex_cex(store))
+    elif name == "cex_dex":
+        loop.run_until_complete(main.check_cex_dex(store, None))
+    elif name == "funding":
+        main.FUNDING_SNAPSHOT = funding
+        main.FUNDING_SNAPSHOT_TS = time.time()  # new snapshot every call, so it is evaluated
+        loop.run_until_complete(main.check_funding())
+
+def measure(fn, repeat: int) -> Tuple[float, float, int]:
+    # (best seconds, median seconds, peak bytes allocated in one call)
+    fn()  # warm-up: interning, lazy imports
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), float(np.median(times)), peak
+
+def bench_helpers(repeat: int) -> List[Tuple[str, float]]:
+    # (name, ns per call)
+    n = 100_000
+    a = np.random.default_rng(0).uniform(1, 2, n).tolist()
+    out = []
+    for label, fn in (
+        ("pct_between", lambda: [main.pct_between(x, 1.5) for x in a]),
+        ("effective_after_costs", lambda: [main.effective_after_costs(x, True, "bybit", ex_name_b="mexc") for x in a]),
+    ):
+        best, _, _ = measure(fn, repeat)
+        out.append((label, best / n * 1e9))
+    return out
+
+def bench_snapshot(label: str, snap: dict, repeat: int, seed: int, checks: List[str]):
+    sent = install_stubs(snap, seed)
+    tickers, funding = snap["tickers"], snap["funding"]
+    n_ex = len(tickers)
+    n_sym = len({s for t in tickers.values() for s in t})
+    store_best, store_med, store_peak = measure(lambda: main.ticker_store_from_dicts(tickers), repeat)
+    store = main.ticker_store_from_dicts(tickers)
+    print(f"\n== {label}: {n_ex} exchanges × {n_sym} symbols ==")
+    print(f"{'stage':<12}{'best ms':>10}{'median ms':>11}{'sym/s':>12}{'peak KiB':>10}{'alerts':>8}")
+    print(f"{'store':<12}{store_best*1e3:>10.2f}{store_med*1e3:>11.2f}{n_sym/store_best:>12.0f}{store_peak/1024:>10.0f}{'':>8}")
+    for check in checks:
+        sent.clear()
+        loop = asyncio.new_event_loop()
+        try:
+            best, med, peak = measure(lambda: run_check(loop, check, store, funding), repeat)
+        finally:
+            loop.close()
+        per_call = len(sent) // (repeat + 2)
+        print(f"{check:<12}{best*1e3:>10.2f}{med*1e3:>11.2f}{n_sym/best:>12.0f}{peak/1024:>10.0f}{per_call:>8}")
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Benchmark the strategy checks on synthetic or recorded snapshots")
+    p.add_argument("--exchanges", type=_ints, default=[3, 10, 20], help="comma-separated exchange counts")
+    p.add_argument("--symbols", type=_ints, default=[500, 2000, 10000], help="comma-separated symbol counts")
+    p.add_argument("--listing", type=float, default=0.7, help="share of symbols listed on each exchange")
+    p.add_argument("--snapshot", action="append", default=[], help="recorded snapshot (.json / .json.gz), repeatable")
+    p.add_argument("--save", help="write the (single) synthetic snapshot here and exit")
+    p.add_argument("--checks", default="cex_cex,cex_dex,funding")
+    p.add_argument("--repeat", type=int, default=10)
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args()
+    logging.getLogger("arb-bot").setLevel(logging.WARNING)
+    checks = [c for c in args.checks.split(",") if c]
+    if args.save:
+        save_snapshot(synthetic_snapshot(args.exchanges[0], args.symbols[0], args.seed, args.listing), args.save)
+        return
+    print(f"python {sys.version.split()[0]}, numpy {np.__version__}, repeat={args.repeat}")
+    for label, ns in bench_helpers(args.repeat):
+        print(f"{label:<24}{ns:>8.0f} ns/call")
+    if args.snapshot:
+        for path in args.snapshot:
+            bench_snapshot(os.path.basename(path), load_snapshot(path), args.repeat, args.seed, checks)
+        return
+    for n_ex in args.exchanges:
+        for n_sym in args.symbols:
+            snap = synthetic_snapshot(n_ex, n_sym, args.seed, args.listing)
+            bench_snapshot("synthetic", snap, args.repeat, args.seed, checks)
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,28 +1,31 @@
 # main.py
 import os
+import gzip
+import json
 import time
 import asyncio
+import sqlite3
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import fnmatch
+import itertools
 import logging
+import cProfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Tuple, List
+from typing import Optional, Dict, Tuple, List, Iterable, Set, Callable
 from itertools import combinations
-from http.server import HTTPServer, SimpleHTTPRequestHandler
-import threading
 
 import aiohttp
+from aiohttp import web
+import numpy as np
 import ccxt.async_support as ccxt
 from web3 import Web3
-from web3.middleware import geth_poa_middleware
 from telegram import Bot, Update
+from telegram.error import RetryAfter
 from telegram.ext import Application, CommandHandler, ContextTypes
 
-# ---------------- tiny HTTP server so Render keeps the service alive -------------
-def run_server():
-    server = HTTPServer(('', 10000), SimpleHTTPRequestHandler)
-    server.serve_forever()
-
-threading.Thread(target=run_server, daemon=True).start()
-
 # ================== CONFIG (ENV) ==================
 TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN")
 USER_ID = int(os.environ.get("USER_ID", "5009858379"))
@@ -30,33 +33,151 @@ USER_ID = int(os.environ.get("USER_ID", "5009858379"))
 # initial capital (will be updated by morning prompt or /capital)
 MY_CAPITAL_USD = float(os.environ.get("MY_CAPITAL_USD", 50.0))
 
+# Sharded scanning: CEX↔CEX evaluation split by symbol range across worker processes (0 = in-process)
+SCAN_SHARDS = int(os.environ.get("SCAN_SHARDS", 0))
+SHARD_TIMEOUT = float(os.environ.get("SHARD_TIMEOUT", 30.0))  # seconds to wait for every shard's results
+# Re-evaluate only symbols whose quotes changed since the previous snapshot, reusing cached results for the rest
+DELTA_EVAL = os.environ.get("DELTA_EVAL", "1") == "1"
+DELTA_FULL_RATIO = float(os.environ.get("DELTA_FULL_RATIO", 0.5))  # above this share of changed rows, rescan everything
+
+# Per-stage cycle timings (rolling p50/p95/p99, /perf); PERF_PROFILE_DIR dumps a cProfile of one cycle
+PERF_STAGES = os.environ.get("PERF_STAGES", "1") == "1"
+PERF_WINDOW = int(os.environ.get("PERF_WINDOW", 500))     # samples kept per stage
+PERF_PROFILE_DIR = os.environ.get("PERF_PROFILE_DIR")    # set to profile the first cycle; /perf profile arms another
+
+# Recorder: every tickers / funding / DEX quote / gas snapshot appended to gzip JSONL segments for replay.py
+RECORD_DIR = os.environ.get("RECORD_DIR")                                     # unset = recorder off
+RECORD_SEGMENT_SECONDS = int(os.environ.get("RECORD_SEGMENT_SECONDS", 3600))  # start a new segment file this often
+
+# /healthz and /metrics (Prometheus text format); Render probes this port to keep the service up
+HTTP_PORT = int(os.environ.get("PORT", 10000))
+HEALTH_MAX_SNAPSHOT_AGE = float(os.environ.get("HEALTH_MAX_SNAPSHOT_AGE", 0))  # seconds, 0 = 3 × CHECK_INTERVAL_SECONDS
+
 MIN_VOLUME_24H = float(os.environ.get("MIN_VOLUME_24H", 500000))   # USD
 MIN_EFF_SPREAD_PERCENT = float(os.environ.get("MIN_EFF_SPREAD_PERCENT", 2.0))
 CHECK_INTERVAL_SECONDS = int(os.environ.get("CHECK_INTERVAL_SECONDS", 300))
 FUNDING_CHECK_INTERVAL = int(os.environ.get("FUNDING_CHECK_INTERVAL", 300))
+DEX_CHECK_INTERVAL = int(os.environ.get("DEX_CHECK_INTERVAL", CHECK_INTERVAL_SECONDS))
+# Adaptive cadence: spot/DEX intervals scale with cross-venue spread volatility vs its running average
+ADAPTIVE_CADENCE = os.environ.get("ADAPTIVE_CADENCE", "1") == "1"
+CADENCE_MIN_FACTOR = float(os.environ.get("CADENCE_MIN_FACTOR", 0.25))  # fastest = base interval × this
+CADENCE_MAX_FACTOR = float(os.environ.get("CADENCE_MAX_FACTOR", 2.0))   # slowest = base interval × this
+SPREAD_VOL_ALPHA = float(os.environ.get("SPREAD_VOL_ALPHA", 0.1))       # EWMA weight of the newest volatility sample
+TICKERS_FETCH_TIMEOUT = float(os.environ.get("TICKERS_FETCH_TIMEOUT", 20.0))  # per exchange, seconds
+FUNDING_FETCH_TIMEOUT = float(os.environ.get("FUNDING_FETCH_TIMEOUT", 30.0))  # per exchange, seconds
+
+# Alerts are queued by the checks and delivered by alert_sender() in the background
+ALERT_QUEUE_MAX = int(os.environ.get("ALERT_QUEUE_MAX", 500))
+ALERT_MIN_INTERVAL = float(os.environ.get("ALERT_MIN_INTERVAL", 1.1))        # seconds between messages (Telegram: ~1/s per chat)
+ALERT_COALESCE_WINDOW = float(os.environ.get("ALERT_COALESCE_WINDOW", 2.0))  # gather a burst into one digest
+ALERT_SEND_RETRIES = int(os.environ.get("ALERT_SEND_RETRIES", 3))
+SIGNAL_DEDUP_SECONDS = int(os.environ.get("SIGNAL_DEDUP_SECONDS", 1800))
+SIGNAL_CACHE_MAX = int(os.environ.get("SIGNAL_CACHE_MAX", 5000))
+
+# Exchange registry: per-venue fees, rate budget, quote currencies and market filters
+EXCHANGES_CONFIG = os.environ.get("EXCHANGES_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "exchanges.json"))
+
+# Streaming market data (websocket) instead of polling fetch_tickers() for CEX↔CEX
+STREAM_MODE = os.environ.get("STREAM_MODE", "0") == "1"
+STREAM_MAX_SYMBOLS = int(os.environ.get("STREAM_MAX_SYMBOLS", 200))        # per exchange
+STREAM_EVAL_DEBOUNCE = float(os.environ.get("STREAM_EVAL_DEBOUNCE", 0.25))  # seconds to coalesce a burst of updates
+STREAM_RECV_TIMEOUT = float(os.environ.get("STREAM_RECV_TIMEOUT", 60.0))    # reconnect if silent this long
+STREAM_CAPTURE_DIR = os.environ.get("STREAM_CAPTURE_DIR")                   # dump raw frames for ws_replay.py
+# override to point a venue at a local stand-in, e.g. STREAM_WS_URL_BYBIT=ws://127.0.0.1:8765/bybit
+STREAM_WS_URLS = {
+    "bybit": os.environ.get("STREAM_WS_URL_BYBIT", "wss://stream.bybit.com/v5/public/spot"),
+    "mexc": os.environ.get("STREAM_WS_URL_MEXC", "wss://wbs.mexc.com/ws"),
+    "bitget": os.environ.get("STREAM_WS_URL_BITGET", "wss://ws.bitget.com/v2/ws/public"),
+}
 
 # Fees & slippage (defaults; can tune via env)
 CEX_FEE_DEFAULT_PCT = float(os.environ.get("CEX_FEE_DEFAULT_PCT", 0.1))
-CEX_FEES_OVERRIDE = {
-    "bybit": float(os.environ.get("CEX_FEE_BYBIT_PCT", 0.055)),
-    "mexc": float(os.environ.get("CEX_FEE_MEXC_PCT", 0.2)),
-    "bitget": float(os.environ.get("CEX_FEE_BITGET_PCT", 0.1)),
-}
-DEX_FEE_PCT = float(os.environ.get("DEX_FEE_PCT", 0.3))
+# CEX_FEE_<EXCHANGE>_PCT beats the fee tier from the exchange registry
+CEX_FEES_OVERRIDE = {k[len("CEX_FEE_"):-len("_PCT")].lower(): float(v) for k, v in os.environ.items()
+                     if k.startswith("CEX_FEE_") and k.endswith("_PCT") and k != "CEX_FEE_DEFAULT_PCT"}
+DEX_FEE_PCT = float(os.environ.get("DEX_FEE_PCT", 0.3))  # flat pool fee for DEX prices not quoted from the pool
 EST_SLIPPAGE_PCT = float(os.environ.get("EST_SLIPPAGE_PCT", 0.3))
 
+# Triangular arbitrage inside one venue (anchor → X → Y → anchor) on the cross pairs of each tickers fetch
+TRIANGULAR = os.environ.get("TRIANGULAR", "1") == "1"
+TRI_MIN_PROFIT_PCT = float(os.environ.get("TRI_MIN_PROFIT_PCT", 0.3))       # after three taker fees
+TRI_MIN_VOLUME_USD = float(os.environ.get("TRI_MIN_VOLUME_USD", 100000))    # 24h volume of every leg
+TRI_ANCHORS = [c.strip().upper() for c in os.environ.get("TRI_ANCHORS", "USDT").split(",") if c.strip()]
+TRI_MAX_ALERTS = int(os.environ.get("TRI_MAX_ALERTS", 10))                  # per venue per cycle, best first
+
+# Order-book depth stage: candidates that pass the flat-cost filter are re-priced at the
+# VWAP for MY_CAPITAL_USD on the real L2 books
+DEPTH_CHECK = os.environ.get("DEPTH_CHECK", "1") == "1"
+DEPTH_LIMIT = int(os.environ.get("DEPTH_LIMIT", 20))                  # book levels per side
+DEPTH_MAX_CANDIDATES = int(os.environ.get("DEPTH_MAX_CANDIDATES", 20))  # per check, best first
+ORDERBOOK_TTL = float(os.environ.get("ORDERBOOK_TTL", 10.0))          # seconds a book is reused
+ORDERBOOK_MAX_INFLIGHT = int(os.environ.get("ORDERBOOK_MAX_INFLIGHT", 4))  # concurrent book requests per exchange
+
 ETH_RPC = os.environ.get("ETH_RPC", "https://eth.llamarpc.com")
 BSC_RPC = os.environ.get("BSC_RPC", "https://bsc-dataseed.binance.org")
-GAS_UPDATE_INTERVAL = int(os.environ.get("GAS_UPDATE_INTERVAL", 3600))
+RPC_POOL_SIZE = int(os.environ.get("RPC_POOL_SIZE", 8))        # keep-alive connections per RPC URL
+RPC_MAX_INFLIGHT = int(os.environ.get("RPC_MAX_INFLIGHT", 8))  # concurrent requests per RPC URL
+RPC_TIMEOUT = float(os.environ.get("RPC_TIMEOUT", 15.0))
+DEX_QUOTE_TTL = float(os.environ.get("DEX_QUOTE_TTL", 30.0))  # seconds a getAmountsOut result is reused
+MULTICALL_BATCH_SIZE = int(os.environ.get("MULTICALL_BATCH_SIZE", 100))  # calls per aggregate3
+MULTICALL_WINDOW = float(os.environ.get("MULTICALL_WINDOW", 0.02))       # seconds to collect a batch
+# DEX route search: direct and one-hop paths (DEX_HOP_TOKENS) on every router of the chain
+DEX_MULTI_HOP = os.environ.get("DEX_MULTI_HOP", "1") == "1"
+DEX_ROUTE_TTL = float(os.environ.get("DEX_ROUTE_TTL", 1800))  # seconds a symbol's winning route is quoted alone
+# local mirror of V2 pair reserves (priced without RPC, at MY_CAPITAL_USD size)
+RESERVE_MIRROR = os.environ.get("RESERVE_MIRROR", "1") == "1"
+RESERVE_POLL_INTERVAL = float(os.environ.get("RESERVE_POLL_INTERVAL", 15.0))  # seconds between Sync log polls
+RESERVE_MAX_LOG_BLOCKS = int(os.environ.get("RESERVE_MAX_LOG_BLOCKS", 2000))  # larger gaps reload reserves instead
+RESERVE_STALE_AFTER = float(os.environ.get("RESERVE_STALE_AFTER", 4 * RESERVE_POLL_INTERVAL))  # unsynced this long: quote live
+RESERVE_MISSING_TTL = float(os.environ.get("RESERVE_MISSING_TTL", 3600))  # seconds before a "no pool" answer is re-checked
+# gas oracle: eth_feeHistory (eth_gasPrice fallback) per chain, smoothed, refreshed in the background
+GAS_UPDATE_INTERVAL = int(os.environ.get("GAS_UPDATE_INTERVAL", 60))
+GAS_EWMA_ALPHA = float(os.environ.get("GAS_EWMA_ALPHA", 0.3))        # weight of the newest reading
+GAS_FEE_HISTORY_BLOCKS = int(os.environ.get("GAS_FEE_HISTORY_BLOCKS", 5))
+GAS_TIP_PERCENTILE = float(os.environ.get("GAS_TIP_PERCENTILE", 50))  # priority fee percentile of recent blocks
+NATIVE_PRICE_TTL = float(os.environ.get("NATIVE_PRICE_TTL", 600))    # CoinGecko ETH/BNB price reuse, when no CEX ticker
 GAS_UNITS_SWAP = int(os.environ.get("GAS_UNITS_SWAP", 200000))
 ETH_GWEI_FALLBACK = float(os.environ.get("ETH_GWEI_FALLBACK", 30.0))
 BNB_GWEI_FALLBACK = float(os.environ.get("BNB_GWEI_FALLBACK", 5.0))
 ETH_PRICE_FALLBACK = float(os.environ.get("ETH_PRICE_FALLBACK", 4619.0))
 BNB_PRICE_FALLBACK = float(os.environ.get("BNB_PRICE_FALLBACK", 550.0))
 
+# token metadata cache (symbol/chain -> address, decimals) persisted across restarts
+TOKEN_CACHE_DB = os.environ.get("TOKEN_CACHE_DB", "token_cache.sqlite3")
+TOKEN_NEGATIVE_TTL = int(os.environ.get("TOKEN_NEGATIVE_TTL", 6 * 3600))    # failed lookups are retried after this
+TOKEN_REFRESH_AGE = int(os.environ.get("TOKEN_REFRESH_AGE", 7 * 86400))     # good entries re-validated after this
+TOKEN_REFRESH_INTERVAL = int(os.environ.get("TOKEN_REFRESH_INTERVAL", 3600))  # background refresh pass
+TOKEN_REFRESH_BATCH = int(os.environ.get("TOKEN_REFRESH_BATCH", 25))        # entries per pass
+TOKEN_REFRESH_PAUSE = float(os.environ.get("TOKEN_REFRESH_PAUSE", 2.5))     # seconds between CoinGecko calls in a pass
+COINGECKO_BACKOFF = float(os.environ.get("COINGECKO_BACKOFF", 60))          # pause after a 429 / 5xx without Retry-After
+
+# boot snapshots (exchange markets, CoinGecko symbol index) for a warm start
+BOOT_CACHE_DIR = os.environ.get("BOOT_CACHE_DIR", "boot_cache")
+
 # DEX router addresses
 UNISWAP_ROUTER = Web3.to_checksum_address("0x7a250d5630B4cF539739dF2C5dAcb4c659F2488D")
 PANCAKE_ROUTER = Web3.to_checksum_address("0x10ED43C718714eb63d5aA57B78B54704E256024E")
+SUSHI_ROUTER = Web3.to_checksum_address("0xd9e1cE17f2641f24aE83637ab66a2cca9C378B9F")
+BISWAP_ROUTER = Web3.to_checksum_address("0x3a6d8cA21D1CF76F653A67577FA0D27453350dD8")
+APESWAP_ROUTER = Web3.to_checksum_address("0xcF0feBd3f17CEf5b47b0cD257aCf6025c5BFf3b7")
+
+# V2 factories behind the routers, and pool fee in basis points
+UNISWAP_FACTORY = Web3.to_checksum_address("0x5C69bEe701ef814a2B6a3EDD4B1652CB9cc5aA6f")
+PANCAKE_FACTORY = Web3.to_checksum_address("0xcA143Ce32Fe78f1f7019d7d551a6402fC5250c73")
+SUSHI_FACTORY = Web3.to_checksum_address("0xC0AEe478e3658e2610c5F7A4A2E1777cE9e4f2Ac")
+BISWAP_FACTORY = Web3.to_checksum_address("0x858E3312ed3A876947EA49d572A7C42DE08af7EE")
+APESWAP_FACTORY = Web3.to_checksum_address("0x0841BD0B734E4F5853f0dD8d7Ea041c241fb0Da6")
+ROUTER_FACTORY = {UNISWAP_ROUTER: UNISWAP_FACTORY, PANCAKE_ROUTER: PANCAKE_FACTORY, SUSHI_ROUTER: SUSHI_FACTORY,
+                  BISWAP_ROUTER: BISWAP_FACTORY, APESWAP_ROUTER: APESWAP_FACTORY}
+ROUTER_FEE_BPS = {UNISWAP_ROUTER: 30, PANCAKE_ROUTER: 25, SUSHI_ROUTER: 30, BISWAP_ROUTER: 10, APESWAP_ROUTER: 20}
+ROUTER_NAMES = {UNISWAP_ROUTER: "Uniswap", PANCAKE_ROUTER: "PancakeSwap", SUSHI_ROUTER: "SushiSwap",
+                BISWAP_ROUTER: "BiSwap", APESWAP_ROUTER: "ApeSwap"}
+# routers tried per chain, and the TOKEN_MAP tokens one-hop routes go through
+DEX_ROUTERS = {"ETH": [UNISWAP_ROUTER, SUSHI_ROUTER], "BSC": [PANCAKE_ROUTER, BISWAP_ROUTER, APESWAP_ROUTER]}
+DEX_HOP_TOKENS = {"ETH": ["WETH", "USDC", "USDT"], "BSC": ["WBNB", "BUSD", "USDT_BSC", "USDC_BSC"]}
+
+# Multicall3 (same address on Ethereum and BSC)
+MULTICALL3 = Web3.to_checksum_address("0xcA11bde05977b3631167028862bE2a173976CA11")
 
 # CoinGecko memecoin mapping (add overrides if needed)
 COINGECKO_IDS_OVERRIDE = {"TRUMP": "maga"}
@@ -64,28 +185,38 @@ COINGECKO_IDS_OVERRIDE = {"TRUMP": "maga"}
 # ================== LOGGING & BOT ==================
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 logger = logging.getLogger("arb-bot")
+STARTUP_T0 = time.monotonic()
 if not TELEGRAM_TOKEN:
     raise ValueError("TELEGRAM_TOKEN must be set in ENV")
 bot = Bot(token=TELEGRAM_TOKEN)
 
 # ================== GLOBAL STATE ==================
+# exchange registry (exchanges.json); used when the file is missing
+DEFAULT_EXCHANGE_CONFIG: Dict[str, dict] = {
+    "bybit": {"enabled": True, "taker_fee_pct": 0.055},
+    "mexc": {"enabled": True, "taker_fee_pct": 0.2},
+    "bitget": {"enabled": True, "taker_fee_pct": 0.1},
+}
+
+def load_exchange_config(path: str) -> Dict[str, dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            cfg = json.load(f)
+    except FileNotFoundError:
+        return {k: dict(v) for k, v in DEFAULT_EXCHANGE_CONFIG.items()}
+    return {name.lower(): dict(v or {}) for name, v in cfg.items()}
+
+EXCHANGE_CONFIG: Dict[str, dict] = load_exchange_config(EXCHANGES_CONFIG)
+
 # enabled exchanges (toggle via commands)
-ENABLED_EXCHANGES: Dict[str, bool] = {"bybit": True, "mexc": True, "bitget": True}
+ENABLED_EXCHANGES: Dict[str, bool] = {name: bool(c.get("enabled", True)) for name, c in EXCHANGE_CONFIG.items()}
 
-# CCXT async clients (no api keys needed for public data)
-EXCHANGES: Dict[str, ccxt.Exchange] = {
-    "bybit": ccxt.bybit({"enableRateLimit": True}),
-    "mexc": ccxt.mexc({"enableRateLimit": True}),
-    "bitget": ccxt.bitget({"enableRateLimit": True}),
-}
+# CCXT async clients (no api keys needed for public data), created on first use by exchange_client()
+EXCHANGES: Dict[str, ccxt.Exchange] = {}
 
-# web3
-w3_eth = Web3(Web3.HTTPProvider(ETH_RPC))
-w3_bsc = Web3(Web3.HTTPProvider(BSC_RPC))
-try:
-    w3_bsc.middleware_onion.inject(geth_poa_middleware, layer=0)
-except Exception:
-    pass
+# web3 is only used for ABI encoding/decoding; calls go over JSON-RPC (rpc_request)
+w3 = Web3()
+RPC_URLS = {"ETH": ETH_RPC, "BSC": BSC_RPC}
 
 # ROUTER ABI (getAmountsOut)
 ROUTER_ABI = [{
@@ -96,9 +227,33 @@ ROUTER_ABI = [{
     "type":"function"
 }]
 
+MULTICALL3_ABI = [{
+    "inputs": [{"components": [{"internalType":"address","name":"target","type":"address"},{"internalType":"bool","name":"allowFailure","type":"bool"},{"internalType":"bytes","name":"callData","type":"bytes"}],"internalType":"struct Multicall3.Call3[]","name":"calls","type":"tuple[]"}],
+    "name":"aggregate3",
+    "outputs":[{"components":[{"internalType":"bool","name":"success","type":"bool"},{"internalType":"bytes","name":"returnData","type":"bytes"}],"internalType":"struct Multicall3.Result[]","name":"returnData","type":"tuple[]"}],
+    "stateMutability":"payable",
+    "type":"function"
+}]
+
+FACTORY_ABI = [{"inputs":[{"internalType":"address","name":"","type":"address"},{"internalType":"address","name":"","type":"address"}],"name":"getPair","outputs":[{"internalType":"address","name":"","type":"address"}],"stateMutability":"view","type":"function"}]
+
+PAIR_ABI = [{"inputs":[],"name":"getReserves","outputs":[{"internalType":"uint112","name":"_reserve0","type":"uint112"},{"internalType":"uint112","name":"_reserve1","type":"uint112"},{"internalType":"uint32","name":"_blockTimestampLast","type":"uint32"}],"stateMutability":"view","type":"function"}]
+
+MULTICALL3_BLOCK_ABI = [{"inputs":[],"name":"getBlockNumber","outputs":[{"internalType":"uint256","name":"blockNumber","type":"uint256"}],"stateMutability":"view","type":"function"}]
+
+SYNC_TOPIC = "0x" + Web3.keccak(text="Sync(uint112,uint112)").hex().removeprefix("0x")
+
 TOKEN_ABI = [{"inputs":[],"name":"decimals","outputs":[{"internalType":"uint8","name":"","type":"uint8"}],"stateMutability":"view","type":"function"}]
 
 # minimal token map
+# contracts built once and reused for every call
+MULTICALL = w3.eth.contract(address=MULTICALL3, abi=MULTICALL3_ABI)
+ERC20 = w3.eth.contract(abi=TOKEN_ABI)
+V2_FACTORY = w3.eth.contract(abi=FACTORY_ABI)
+V2_PAIR = w3.eth.contract(abi=PAIR_ABI)
+BLOCK_NUMBER_CALL = w3.eth.contract(abi=MULTICALL3_BLOCK_ABI).encodeABI(fn_name="getBlockNumber")
+ROUTER_CONTRACTS: Dict[str, object] = {}
+
 TOKEN_MAP = {
     "WETH": {"eth": Web3.to_checksum_address("0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"), "decimals": 18},
     "USDT": {"eth": Web3.to_checksum_address("0xdAC17F958D2ee523a2206206994597C13D831ec7"), "decimals": 6},
@@ -106,52 +261,422 @@ TOKEN_MAP = {
     "WBNB": {"bsc": Web3.to_checksum_address("0xBB4CdB9CBd36B01bD1cBaEBF2De08d9173bc095c"), "decimals": 18},
     "BUSD": {"bsc": Web3.to_checksum_address("0xe9e7cea3dedca5984780bafc599bd69add087d56"), "decimals": 18},
     "USDT_BSC": {"bsc": Web3.to_checksum_address("0x55d398326f99059fF775485246999027B3197955"), "decimals": 18},
+    "USDC_BSC": {"bsc": Web3.to_checksum_address("0x8AC76a51cc950d9822D68b83fE1Ad97B32Cd580d"), "decimals": 18},
 }
 
 # caches
 COINGECKE_API = "https://api.coingecko.com/api/v3"
 COINGECKO_SYMBOL_TO_ID: Dict[str, str] = {}
 TOKEN_ADDR_CACHE: Dict[Tuple[str,str], Optional[Tuple[str,int]]] = {}
-SIGNAL_CACHE: Dict[str, float] = {}
-GAS_FEES_USD = {"ETH": None, "BNB": None}
-LAST_GAS_UPDATE = 0
+TOKEN_ADDR_TS: Dict[Tuple[str,str], float] = {}  # when each TOKEN_ADDR_CACHE entry was resolved
+TOKEN_DB: Optional[sqlite3.Connection] = None
+# dedup key -> expires_at, oldest first; bounded by SIGNAL_CACHE_MAX
+SIGNAL_CACHE: "OrderedDict[str, float]" = OrderedDict()
+# (text, dedup_key) waiting for alert_sender()
+ALERT_QUEUE: asyncio.Queue = asyncio.Queue(maxsize=ALERT_QUEUE_MAX)
+LAST_ALERT_SENT = 0.0
+# when set, every alert goes here (text, dedup_key) instead of Telegram; used by bench/replay
+ALERT_SINK: Optional[Callable[[str, Optional[str]], None]] = None
+# (chain, router, path, amount_in) -> (fetched_at, amounts or None)
+DEX_QUOTE_CACHE: Dict[Tuple[str,str,Tuple[str,...],int], Tuple[float, Optional[List[int]]]] = {}
+DEX_QUOTE_INFLIGHT: Dict[Tuple[str,str,Tuple[str,...],int], asyncio.Task] = {}
+# symbol -> (chosen_at, chain, router, path) of its best-quoting route, quoted alone until DEX_ROUTE_TTL
+DEX_ROUTES: Dict[Tuple[str, bool], Tuple[float, str, str, Tuple[str,...]]] = {}
+# chain -> calls waiting for the next aggregate3: (target, calldata, future for returnData)
+MULTICALL_PENDING: Dict[str, List[Tuple[str, str, asyncio.Future]]] = {}
+MULTICALL_FLUSH: Dict[str, asyncio.Task] = {}
+RPC_SESSIONS: Dict[str, aiohttp.ClientSession] = {}
+RPC_LIMITS: Dict[str, asyncio.Semaphore] = {}
+RPC_IDS = itertools.count(1)
+COINGECKO_LOCK = asyncio.Lock()  # /coins/{id} lookups one at a time (free-tier rate limit)
+COINGECKO_BACKOFF_UNTIL = 0.0    # no /coins/{id} lookups before this, after a rate limit or server error
+# V2 reserve mirror: one row per pool in PAIR_RESERVES (reserve0, reserve1)
+PAIR_INDEX: Dict[Tuple[str,str,str,str], int] = {}  # (chain, factory, token0, token1) -> pair id, -1 = no pool
+PAIR_BY_ADDR: Dict[Tuple[str,str], int] = {}        # (chain, pair address lower) -> pair id
+PAIR_ADDR: List[str] = []
+PAIR_CHAIN: List[str] = []
+PAIR_TOKEN0: List[str] = []
+PAIR_BLOCK: List[int] = []                          # reserves are at least as new as this block
+PAIR_RESERVES = np.zeros((0, 2))
+PAIR_FEE_MULT = np.zeros(0)                         # 1 - pool fee
+MIRROR_FROM_BLOCK: Dict[str, int] = {}              # next block to scan for Sync logs, per chain
+MIRROR_SYNCED_AT: Dict[str, float] = {}             # last successful Sync poll / reload, per chain
+PAIR_MISSING_AT: Dict[Tuple[str,str,str,str], float] = {}  # when a PAIR_INDEX entry was found to be -1
+# (chain, router, path) -> [(pair id, input is token0), ...] per hop; only mirrorable routes are kept
+MIRROR_ROUTES: Dict[Tuple[str,str,Tuple[str,...]], List[Tuple[int,bool]]] = {}
+MIRROR_LOCK = asyncio.Lock()
+# swap cost per chain in USD, read by effective_after_costs(); fallback estimate until the oracle reports
+GAS_FEES_USD: Dict[str, Optional[float]] = {
+    "ETH": ETH_GWEI_FALLBACK * 1e-9 * GAS_UNITS_SWAP * ETH_PRICE_FALLBACK,
+    "BSC": BNB_GWEI_FALLBACK * 1e-9 * GAS_UNITS_SWAP * BNB_PRICE_FALLBACK,
+}
+GAS_GWEI: Dict[str, float] = {}                           # smoothed gas price per chain
+NATIVE_PRICE_USD: Dict[str, Tuple[float, float]] = {}     # chain -> (fetched_at, CoinGecko price)
+LAST_GAS_UPDATE = 0.0
+FIRST_SIGNAL_AT: Optional[float] = None  # seconds from start to the first signal sent
+SNAPSHOT_TS = 0.0                 # when the last tickers snapshot was requested
+SNAPSHOT_MISSING: List[str] = []  # enabled exchanges absent from the last snapshot
+# (exchange, symbol) -> (fetched_at, order book or None); shared by the spot and DEX checks
+ORDERBOOK_CACHE: Dict[Tuple[str,str], Tuple[float, Optional[dict]]] = {}
+ORDERBOOK_INFLIGHT: Dict[Tuple[str,str], asyncio.Task] = {}
+ORDERBOOK_LIMITS: Dict[str, asyncio.Semaphore] = {}
+# funding rates, refreshed by the "funding" job and read by check_funding()
+FUNDING_SNAPSHOT: Dict[str, dict] = {}
+FUNDING_SNAPSHOT_TS = 0.0
+FUNDING_CHECKED_TS = 0.0  # snapshot time check_funding() last evaluated
+# interned symbols: row index in every ticker store
+SYMBOL_IDS: Dict[str, int] = {}
+SYMBOLS: List[str] = []
+# streaming mode: current quotes as a ticker store (same layout as a REST snapshot)
+LIVE_BOOK: Optional[dict] = None
+STREAM_DIRTY: Set[str] = set()
+STREAM_WAKEUP = asyncio.Event()
+# triangular: exchange -> {"ts", "pairs", "bid", "ask", "qvol_usd", "index"}; index is rebuilt when pairs change
+CROSS_BOOK: Dict[str, dict] = {}
+MARKETS_WARM: Set[str] = set()  # venues whose markets came from the boot snapshot
+# scheduler: job name -> {"fn", "base", "interval", "deadline", "adaptive", "next", "task", ...}
+SCHEDULE: Dict[str, dict] = {}
+SCHEDULE_WAKEUP = asyncio.Event()
+# shard workers: {"procs", "tasks" (one queue each), "results", "cycle"}
+SHARD_POOL: Optional[dict] = None
+LATEST_STORE: Optional[dict] = None  # last REST tickers store, for jobs that don't fetch their own
+PREV_TICKERS: Optional[dict] = None  # previous REST store, the baseline for the next one's dirty rows
+# delta evaluation: CEX↔CEX records of the last evaluated store
+CEX_CEX_CACHE: Dict[str, object] = {"ts": None, "params": None, "exchanges": None, "recs": None}
+# cross-venue spread volatility: last per-symbol spreads and the running average
+SPREAD_VOL: Dict[str, object] = {"prev": None, "prev_ts": 0.0, "ewma": None, "factor": 1.0}
+# metrics: (name, sorted label pairs) -> value; summaries keep [count, sum]
+METRIC_COUNTERS: Dict[Tuple[str, tuple], float] = {}
+METRIC_GAUGES: Dict[Tuple[str, tuple], float] = {}
+METRIC_SUMMARIES: Dict[Tuple[str, tuple], List[float]] = {}
+RECORD_QUEUE: asyncio.Queue = asyncio.Queue(maxsize=64)  # (kind, ts, data) for recorder_service()
+PERF_SAMPLES: Dict[str, deque] = {}         # stage -> last PERF_WINDOW durations (seconds)
+PERF_PROFILE_NEXT = bool(PERF_PROFILE_DIR)  # profile the next scan cycle
 
 # ================== HELPERS ==================
+def startup_phase(name: str):
+    logger.info("Startup: %s (+%.2fs)", name, time.monotonic() - STARTUP_T0)
+
 def pct_between(a: float, b: float) -> Optional[float]:
     if a is None or b is None or (a + b) == 0:
         return None
     return abs((a - b) / ((a + b) / 2) * 100)
 
-def effective_after_costs(raw_pct: float, is_cex_cex: bool, ex_name: str, chain_for_gas: str = "ETH") -> float:
-    cex_fee = CEX_FEES_OVERRIDE.get(ex_name.lower(), CEX_FEE_DEFAULT_PCT)
+def cex_fee_pct(ex_name: str) -> float:
+    name = ex_name.lower()
+    if name in CEX_FEES_OVERRIDE:
+        return CEX_FEES_OVERRIDE[name]
+    cfg = EXCHANGE_CONFIG.get(name) or {}
+    fee = cfg.get("taker_fee_pct", CEX_FEE_DEFAULT_PCT)
+    # tiers: [[30d volume USD, taker %], ...], the highest one our volume reaches
+    volume = cfg.get("volume_30d_usd", 0)
+    for min_volume, tier_fee in sorted(cfg.get("fee_tiers") or []):
+        if volume >= min_volume:
+            fee = tier_fee
+    return float(fee)
+
+def effective_after_costs(raw_pct: float, is_cex_cex: bool, ex_name: str, chain_for_gas: str = "ETH", ex_name_b: Optional[str] = None,
+                          slippage_pct: Optional[float] = None, dex_fee_pct: Optional[float] = None) -> float:
+    # slippage_pct overrides the flat EST_SLIPPAGE_PCT (0 when prices are already VWAPs),
+    # dex_fee_pct the flat DEX_FEE_PCT (0 when the DEX price is a quote, which nets the pool fee)
+    cex_fee = cex_fee_pct(ex_name)
+    slip = EST_SLIPPAGE_PCT if slippage_pct is None else slippage_pct
     gas_usd = GAS_FEES_USD.get(chain_for_gas, 0.0) or 0.0
     gas_pct = (gas_usd / MY_CAPITAL_USD) * 100 if MY_CAPITAL_USD and gas_usd else 0.0
     if is_cex_cex:
-        fees = (2 * cex_fee) + EST_SLIPPAGE_PCT
+        # taker fee on the buy venue and on the sell venue
+        fees = cex_fee + cex_fee_pct(ex_name_b or ex_name) + slip
     else:
-        fees = cex_fee + DEX_FEE_PCT + EST_SLIPPAGE_PCT + gas_pct
+        fees = cex_fee + (DEX_FEE_PCT if dex_fee_pct is None else dex_fee_pct) + slip + gas_pct
     return raw_pct - fees
 
-async def safe_send_html(text: str, dedup_key: Optional[str] = None, dedup_seconds: int = 1800):
+# ---------------- metrics ----------------
+METRIC_HELP = {
+    "arb_cycle_seconds": "Duration of one scan cycle",
+    "arb_stage_seconds": "Duration of one cycle stage",
+    "arb_tickers_fetch_seconds": "fetch_tickers latency per exchange",
+    "arb_tickers_fetch_errors_total": "fetch_tickers timeouts and errors per exchange",
+    "arb_funding_fetch_seconds": "fetch_funding_rates latency per exchange",
+    "arb_funding_fetch_errors_total": "fetch_funding_rates timeouts and errors per exchange",
+    "arb_rpc_seconds": "JSON-RPC request latency",
+    "arb_rpc_requests_total": "JSON-RPC requests",
+    "arb_rpc_errors_total": "Failed JSON-RPC requests",
+    "arb_cache_requests_total": "Cache lookups by result",
+    "arb_cache_hit_ratio": "Cache hits / lookups since start",
+    "arb_alerts_total": "Alerts by outcome",
+    "arb_alert_queue_depth": "Alerts waiting to be sent",
+    "arb_snapshot_age_seconds": "Age of the last tickers snapshot",
+    "arb_funding_snapshot_age_seconds": "Age of the last funding snapshot",
+    "arb_snapshot_missing_exchanges": "Enabled exchanges absent from the last tickers snapshot",
+    "arb_uptime_seconds": "Seconds since start",
+    "arb_gas_gwei": "Smoothed gas price per chain",
+    "arb_gas_swap_usd": "Estimated swap gas cost per chain",
+    "arb_job_seconds": "Duration of one scheduled job run",
+    "arb_job_interval_seconds": "Current interval of a scheduled job",
+    "arb_job_skips_total": "Slots skipped because the previous run was still going",
+    "arb_job_overruns_total": "Job runs cancelled at their deadline",
+    "arb_spread_volatility": "Mean cross-venue spread move, % per sqrt(minute)",
+    "arb_cadence_factor": "Adaptive interval multiplier (<1 = faster)",
+    "arb_delta_dirty_rows": "Symbols whose quotes changed since the previous snapshot",
+    "arb_delta_rows_total": "Symbols per check by evaluation (scanned / reused)",
+}
+
+def _metric_key(name: str, labels: dict) -> Tuple[str, tuple]:
+    return name, tuple(sorted(labels.items()))
+
+def metric_inc(name: str, value: float = 1.0, **labels):
+    key = _metric_key(name, labels)
+    METRIC_COUNTERS[key] = METRIC_COUNTERS.get(key, 0.0) + value
+
+def metric_set(name: str, value: float, **labels):
+    METRIC_GAUGES[_metric_key(name, labels)] = value
+
+def metric_observe(name: str, value: float, **labels):
+    s = METRIC_SUMMARIES.setdefault(_metric_key(name, labels), [0, 0.0])
+    s[0] += 1; s[1] += value
+
+def cache_lookup(cache: str, hit: bool):
+    metric_inc("arb_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+def _metric_line(name: str, labels: tuple, value: float) -> str:
+    if labels:
+        inner = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+        return f"{name}{{{inner}}} {float(value)!r}"
+    return f"{name} {float(value)!r}"
+
+def render_metrics() -> str:
+    now = time.time()
+    metric_set("arb_alert_queue_depth", ALERT_QUEUE.qsize())
+    metric_set("arb_uptime_seconds", time.monotonic() - STARTUP_T0)
+    metric_set("arb_snapshot_missing_exchanges", len(SNAPSHOT_MISSING))
+    if SNAPSHOT_TS:
+        metric_set("arb_snapshot_age_seconds", now - SNAPSHOT_TS)
+    if FUNDING_SNAPSHOT_TS:
+        metric_set("arb_funding_snapshot_age_seconds", now - FUNDING_SNAPSHOT_TS)
+    lookups: Dict[str, List[float]] = {}
+    for (name, labels), v in METRIC_COUNTERS.items():
+        if name == "arb_cache_requests_total":
+            d = dict(labels)
+            c = lookups.setdefault(d["cache"], [0.0, 0.0])
+            c[0] += v if d["result"] == "hit" else 0.0
+            c[1] += v
+    for cache, (hits, total) in lookups.items():
+        metric_set("arb_cache_hit_ratio", hits / total if total else 0.0, cache=cache)
+    by_name: Dict[str, List[str]] = {}
+    kinds: Dict[str, str] = {}
+    for kind, store in (("counter", METRIC_COUNTERS), ("gauge", METRIC_GAUGES)):
+        for (name, labels), v in sorted(store.items()):
+            kinds[name] = kind
+            by_name.setdefault(name, []).append(_metric_line(name, labels, v))
+    for (name, labels), (count, total) in sorted(METRIC_SUMMARIES.items()):
+        kinds[name] = "summary"
+        by_name.setdefault(name, []).extend([_metric_line(name + "_count", labels, count), _metric_line(name + "_sum", labels, total)])
+    out: List[str] = []
+    for name, lines in by_name.items():
+        out.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+        out.append(f"# TYPE {name} {kinds[name]}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
+
+# ---------------- stage profiler ----------------
+# `with stage_timer("name"):` around a hot-path stage; with PERF_STAGES=0 it is a shared
+# nullcontext. Async stages measure wall time, so concurrent stages overlap.
+_NO_TIMER = nullcontext()
+
+@contextmanager
+def _stage_timer(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        samples = PERF_SAMPLES.get(name)
+        if samples is None:
+            samples = PERF_SAMPLES[name] = deque(maxlen=PERF_WINDOW)
+        samples.append(dt)
+        metric_observe("arb_stage_seconds", dt, stage=name)
+
+def stage_timer(name: str):
+    return _stage_timer(name) if PERF_STAGES else _NO_TIMER
+
+async def timed_stage(name: str, coro):
+    with stage_timer(name):
+        return await coro
+
+def perf_report() -> List[Tuple[str, int, float, float, float]]:
+    # (stage, samples, p50, p95, p99) in ms, slowest p95 first
+    rows = []
+    for name, samples in list(PERF_SAMPLES.items()):
+        if samples:
+            p50, p95, p99 = np.percentile(np.fromiter(samples, dtype=float), [50, 95, 99]) * 1000
+            rows.append((name, len(samples), float(p50), float(p95), float(p99)))
+    return sorted(rows, key=lambda r: -r[3])
+
+@contextmanager
+def cycle_profile():
+    # cProfile of one whole cycle when armed; everything on the event loop during the
+    # cycle (background services included) shows up in the dump
+    global PERF_PROFILE_NEXT
+    if not PERF_PROFILE_NEXT:
+        yield
+        return
+    PERF_PROFILE_NEXT = False
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        out_dir = PERF_PROFILE_DIR or "profiles"
+        try:
+            os.makedirs(out_dir, exist_ok=True)
+            path = os.path.join(out_dir, f"cycle-{datetime.now():%Y%m%d-%H%M%S}.prof")
+            prof.dump_stats(path)
+            logger.info("Cycle profile written to %s", path)
+        except OSError as e:
+            logger.warning("cycle profile dump failed: %s", e)
+
+async def safe_send_html(text: str) -> bool:
+    for attempt in range(ALERT_SEND_RETRIES):
+        try:
+            await bot.send_message(chat_id=USER_ID, text=text, parse_mode="HTML")
+            return True
+        except RetryAfter as e:
+            # flood control: Telegram says exactly how long to back off
+            delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+            logger.warning("TG flood control, retry in %.0fs", delay)
+            await asyncio.sleep(delay + 0.5)
+        except Exception as e:
+            logger.error("TG send error: %s", e)
+            return False
+    return False
+
+# ---------------- alerts ----------------
+# Checks call queue_alert() and move on; alert_sender() owns the Telegram round trips,
+# paces them to the per-chat limit and folds a burst from one cycle into a digest.
+TG_MESSAGE_LIMIT = 4096
+
+def _signal_seen(key: str, now: float) -> bool:
+    while SIGNAL_CACHE:
+        oldest, expires = next(iter(SIGNAL_CACHE.items()))
+        if expires > now and len(SIGNAL_CACHE) <= SIGNAL_CACHE_MAX:
+            break
+        SIGNAL_CACHE.popitem(last=False)
+    expires = SIGNAL_CACHE.get(key)
+    return expires is not None and expires > now
+
+def queue_alert(text: str, dedup_key: Optional[str] = None, dedup_seconds: int = SIGNAL_DEDUP_SECONDS) -> bool:
+    if ALERT_SINK is not None:
+        ALERT_SINK(text, dedup_key)
+        return True
     now = time.time()
     if dedup_key:
-        last = SIGNAL_CACHE.get(dedup_key)
-        if last and (now - last) < dedup_seconds:
+        if _signal_seen(dedup_key, now):
             logger.debug("skip duplicate signal %s", dedup_key)
-            return
+            return False
+        SIGNAL_CACHE[dedup_key] = now + dedup_seconds
+        SIGNAL_CACHE.move_to_end(dedup_key)
     try:
-        await bot.send_message(chat_id=USER_ID, text=text, parse_mode="HTML")
+        ALERT_QUEUE.put_nowait((text, dedup_key))
+    except asyncio.QueueFull:
+        logger.warning("alert queue full, dropping %s", dedup_key or "no-key")
+        metric_inc("arb_alerts_total", result="dropped")
         if dedup_key:
-            SIGNAL_CACHE[dedup_key] = now
-        logger.info("Sent TG message (%s)", dedup_key or "no-key")
-    except Exception as e:
-        logger.error("TG send error: %s", e)
+            SIGNAL_CACHE.pop(dedup_key, None)
+        return False
+    return True
+
+def _digests(batch: List[Tuple[str, Optional[str]]]) -> List[Tuple[str, List[Optional[str]]]]:
+    if len(batch) == 1:
+        return [(batch[0][0], [batch[0][1]])]
+    out: List[Tuple[str, List[Optional[str]]]] = []
+    parts: List[str] = []
+    keys: List[Optional[str]] = []
+    size = 0
+    for text, key in batch:
+        if parts and size + len(text) + 2 > TG_MESSAGE_LIMIT - 64:
+            out.append(("\n\n".join(parts), keys))
+            parts, keys, size = [], [], 0
+        parts.append(text); keys.append(key)
+        size += len(text) + 2
+    if parts:
+        out.append(("\n\n".join(parts), keys))
+    if len(out) == 1:
+        return [(f"📦 <b>Сигналов: {len(batch)}</b>\n\n{out[0][0]}", out[0][1])]
+    return [(f"📦 <b>Сигналы {i}/{len(out)}</b>\n\n{text}", keys) for i, (text, keys) in enumerate(out, 1)]
+
+async def alert_sender():
+    global LAST_ALERT_SENT, FIRST_SIGNAL_AT
+    while True:
+        batch = [await ALERT_QUEUE.get()]
+        # the rest of the cycle's signals usually arrive within the window
+        await asyncio.sleep(ALERT_COALESCE_WINDOW)
+        while True:
+            try:
+                batch.append(ALERT_QUEUE.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        for text, keys in _digests(batch):
+            wait = LAST_ALERT_SENT + ALERT_MIN_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            with stage_timer("telegram_send"):
+                ok = await safe_send_html(text)
+            LAST_ALERT_SENT = time.monotonic()
+            metric_inc("arb_alerts_total", len(keys), result="sent" if ok else "failed")
+            if not ok:
+                # let the next cycle raise the same signals again
+                for key in keys:
+                    if key:
+                        SIGNAL_CACHE.pop(key, None)
+                continue
+            if FIRST_SIGNAL_AT is None and any(keys):
+                FIRST_SIGNAL_AT = time.monotonic() - STARTUP_T0
+                startup_phase("first signal sent")
+            logger.info("Sent TG message (%s)", ", ".join(k or "no-key" for k in keys))
+
+# ---------------- on-chain RPC ----------------
+# One keep-alive pool and one in-flight cap per RPC URL, shared by every caller.
+def _rpc_session(url: str) -> aiohttp.ClientSession:
+    session = RPC_SESSIONS.get(url)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=RPC_POOL_SIZE, keepalive_timeout=60, ttl_dns_cache=300)
+        session = RPC_SESSIONS[url] = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=RPC_TIMEOUT))
+        RPC_LIMITS[url] = asyncio.Semaphore(RPC_MAX_INFLIGHT)
+    return session
+
+async def rpc_request(chain: str, method: str, params: list):
+    url = RPC_URLS[chain]
+    session = _rpc_session(url)
+    metric_inc("arb_rpc_requests_total", chain=chain, method=method)
+    async with RPC_LIMITS[url]:
+        t0 = time.monotonic()
+        try:
+            async with session.post(url, json={"jsonrpc": "2.0", "id": next(RPC_IDS), "method": method, "params": params}) as r:
+                r.raise_for_status()
+                body = await r.json(content_type=None)
+        except Exception:
+            metric_inc("arb_rpc_errors_total", chain=chain, method=method)
+            raise
+        finally:
+            metric_observe("arb_rpc_seconds", time.monotonic() - t0, chain=chain, method=method)
+    if body.get("error"):
+        metric_inc("arb_rpc_errors_total", chain=chain, method=method)
+        raise RuntimeError(f"{method} error: {body['error']}")
+    return body.get("result")
+
+async def eth_call(chain: str, to: str, data: str) -> bytes:
+    result = await rpc_request(chain, "eth_call", [{"to": to, "data": data}, "latest"])
+    return bytes.fromhex(result[2:]) if result else b""
+
+async def close_rpc_sessions():
+    for session in RPC_SESSIONS.values():
+        await session.close()
+    RPC_SESSIONS.clear()
 
 # ---------------- CoinGecko helpers ----------------
-async def init_coingecko(session: aiohttp.ClientSession):
+async def refresh_coingecko_index(session: aiohttp.ClientSession):
     global COINGECKO_SYMBOL_TO_ID
-    if COINGECKO_SYMBOL_TO_ID:
-        return
     url = f"{COINGECKE_API}/coins/list"
     try:
         async with session.get(url, timeout=30) as r:
@@ -166,20 +691,68 @@ async def init_coingecko(session: aiohttp.ClientSession):
                 for k,v in COINGECKO_IDS_OVERRIDE.items():
                     mapping[k.lower()] = v
                 COINGECKO_SYMBOL_TO_ID = mapping
-                logger.info("CoinGecko list loaded")
+                await asyncio.to_thread(write_boot_snapshot, "coingecko_ids", mapping)
+                logger.info("CoinGecko list loaded (%d symbols)", len(mapping))
             else:
-                COINGECKO_SYMBOL_TO_ID = {}
+                # keep the boot snapshot, if any
                 logger.warning("CoinGecko list fetch failed %s", r.status)
     except Exception as e:
-        COINGECKO_SYMBOL_TO_ID = {}
         logger.warning("CoinGecko init error: %s", e)
 
 async def get_coin_id(symbol: str) -> Optional[str]:
     return COINGECKO_SYMBOL_TO_ID.get(symbol.lower())
 
+def _token_db() -> sqlite3.Connection:
+    global TOKEN_DB
+    if TOKEN_DB is None:
+        TOKEN_DB = sqlite3.connect(TOKEN_CACHE_DB)
+        TOKEN_DB.execute("CREATE TABLE IF NOT EXISTS tokens (symbol TEXT NOT NULL, chain TEXT NOT NULL, address TEXT, "
+                         "decimals INTEGER, updated_at REAL NOT NULL, PRIMARY KEY (symbol, chain))")
+    return TOKEN_DB
+
+def load_token_cache():
+    now = time.time()
+    loaded = skipped = 0
+    try:
+        rows = _token_db().execute("SELECT symbol, chain, address, decimals, updated_at FROM tokens").fetchall()
+    except sqlite3.Error as e:
+        logger.warning("token cache load error: %s", e)
+        return
+    for symbol, chain, addr, decimals, updated_at in rows:
+        if addr is None and now - updated_at >= TOKEN_NEGATIVE_TTL:
+            skipped += 1
+            continue
+        TOKEN_ADDR_CACHE[(symbol, chain)] = (addr, int(decimals)) if addr else None
+        TOKEN_ADDR_TS[(symbol, chain)] = updated_at
+        loaded += 1
+    logger.info("Token cache: %d entries loaded, %d expired failures dropped", loaded, skipped)
+
+def _remember_token(key: Tuple[str,str], value: Optional[Tuple[str,int]]):
+    now = time.time()
+    TOKEN_ADDR_CACHE[key] = value
+    TOKEN_ADDR_TS[key] = now
+    try:
+        db = _token_db()
+        db.execute("INSERT OR REPLACE INTO tokens (symbol, chain, address, decimals, updated_at) VALUES (?, ?, ?, ?, ?)",
+                   (key[0], key[1], value[0] if value else None, value[1] if value else None, now))
+        db.commit()
+    except sqlite3.Error as e:
+        logger.debug("token cache write error %s: %s", key, e)
+
+def _token_cached(key: Tuple[str,str]) -> bool:
+    if key not in TOKEN_ADDR_CACHE:
+        return False
+    if TOKEN_ADDR_CACHE[key] is None and time.time() - TOKEN_ADDR_TS.get(key, 0) >= TOKEN_NEGATIVE_TTL:
+        # failed lookup has expired: forget it so the next caller retries
+        del TOKEN_ADDR_CACHE[key]
+        return False
+    return True
+
 async def fetch_token_address(session: aiohttp.ClientSession, symbol: str, chain: str) -> Optional[Tuple[str,int]]:
     key = (symbol.upper(), chain.upper())
-    if key in TOKEN_ADDR_CACHE:
+    hit = _token_cached(key)
+    cache_lookup("token", hit)
+    if hit:
         return TOKEN_ADDR_CACHE[key]
     # check TOKEN_MAP
     tinfo = TOKEN_MAP.get(symbol.upper())
@@ -187,227 +760,1597 @@ async def fetch_token_address(session: aiohttp.ClientSession, symbol: str, chain
         addr = tinfo.get(chain.lower())
         decimals = tinfo.get("decimals", 18)
         TOKEN_ADDR_CACHE[key] = (addr, int(decimals))
+        TOKEN_ADDR_TS[key] = float("inf")
         return TOKEN_ADDR_CACHE[key]
+    if not COINGECKO_SYMBOL_TO_ID:
+        # symbol index not loaded yet: don't cache a guess made without it
+        return None
+    async with COINGECKO_LOCK:
+        # resolved by another caller while we waited
+        if _token_cached(key):
+            return TOKEN_ADDR_CACHE[key]
+        try:
+            value = await _lookup_token_address(session, symbol, chain)
+        except Exception as e:
+            # rate limit, server or RPC trouble is not a miss: nothing is cached, a later cycle retries
+            logger.debug("fetch_token_address %s %s error: %s", symbol, chain, e)
+            return None
+        _remember_token(key, value)
+        if value:
+            await asyncio.sleep(0.08)
+        return value
+
+async def _coingecko_token_address(session: aiohttp.ClientSession, symbol: str, chain: str) -> Optional[str]:
+    # None only for a real miss (unknown coin, no address on the chain); transient errors raise
+    global COINGECKO_BACKOFF_UNTIL
+    if time.time() < COINGECKO_BACKOFF_UNTIL:
+        raise aiohttp.ClientError("CoinGecko backing off")
     coin_id = await get_coin_id(symbol) or COINGECKO_IDS_OVERRIDE.get(symbol.upper(), symbol.lower())
     url = f"{COINGECKE_API}/coins/{coin_id}"
-    try:
-        async with session.get(url, timeout=30) as r:
-            if r.status != 200:
-                TOKEN_ADDR_CACHE[key] = None
-                return None
-            info = await r.json()
-            plat_key = "ethereum" if chain.upper() == "ETH" else "binance-smart-chain"
-            addr = info.get("platforms", {}).get(plat_key)
-            if not addr:
-                TOKEN_ADDR_CACHE[key] = None
-                return None
-            addr = Web3.to_checksum_address(addr)
-            w3 = w3_eth if chain.upper() == "ETH" else w3_bsc
+    async with session.get(url, timeout=30) as r:
+        if r.status == 429 or r.status >= 500:
             try:
-                contract = w3.eth.contract(address=addr, abi=TOKEN_ABI)
-                decimals = await asyncio.to_thread(contract.functions.decimals.call)
-            except Exception:
-                decimals = 18
-            TOKEN_ADDR_CACHE[key] = (addr, int(decimals))
-            await asyncio.sleep(0.08)
-            return TOKEN_ADDR_CACHE[key]
-    except Exception as e:
-        logger.debug("fetch_token_address error %s: %s", symbol, e)
-        TOKEN_ADDR_CACHE[key] = None
+                wait = float(r.headers.get("Retry-After", COINGECKO_BACKOFF))
+            except ValueError:
+                wait = COINGECKO_BACKOFF
+            COINGECKO_BACKOFF_UNTIL = time.time() + wait
+            logger.warning("CoinGecko %s for %s, backing off %.0fs", r.status, coin_id, wait)
+            r.raise_for_status()
+        if r.status != 200:
+            return None
+        info = await r.json()
+    plat_key = "ethereum" if chain.upper() == "ETH" else "binance-smart-chain"
+    addr = info.get("platforms", {}).get(plat_key)
+    return Web3.to_checksum_address(addr) if addr else None
+
+async def _token_decimals(chain: str, addr: str) -> int:
+    # 18 only when decimals() reverts; an RPC failure raises, so a guess is never cached
+    data = await multicall("ETH" if chain.upper() == "ETH" else "BSC", addr, ERC20.encodeABI(fn_name="decimals"))
+    return int(w3.codec.decode(["uint8"], data)[0]) if data else 18
+
+async def _lookup_token_address(session: aiohttp.ClientSession, symbol: str, chain: str) -> Optional[Tuple[str,int]]:
+    addr = await _coingecko_token_address(session, symbol, chain)
+    if not addr:
         return None
+    return addr, await _token_decimals(chain, addr)
+
+async def refresh_token_cache(session: aiohttp.ClientSession):
+    # expired failures and old entries, oldest first; CoinGecko paced, decimals in one multicall
+    now = time.time()
+    due = sorted((ts, key) for key, ts in TOKEN_ADDR_TS.items()
+                 if now - ts >= (TOKEN_NEGATIVE_TTL if TOKEN_ADDR_CACHE.get(key) is None else TOKEN_REFRESH_AGE))
+    due = [key for _, key in due[:TOKEN_REFRESH_BATCH]]
+    if not due:
+        return
+    found: List[Tuple[Tuple[str,str], str]] = []
+    async with COINGECKO_LOCK:
+        for key in due:
+            try:
+                addr = await _coingecko_token_address(session, key[0], key[1])
+            except Exception as e:
+                # transient: the entry stays as it is and is due again next pass
+                logger.debug("token refresh %s error: %s", key, e)
+                if time.time() < COINGECKO_BACKOFF_UNTIL:
+                    break
+                continue
+            if addr:
+                found.append((key, addr))
+            elif TOKEN_ADDR_CACHE.get(key):
+                # a known address outlives a lookup that no longer finds it
+                _remember_token(key, TOKEN_ADDR_CACHE[key])
+            else:
+                _remember_token(key, None)
+            await asyncio.sleep(TOKEN_REFRESH_PAUSE)
+    decimals = await asyncio.gather(*(_token_decimals(key[1], addr) for key, addr in found), return_exceptions=True)
+    for (key, addr), dec in zip(found, decimals):
+        if isinstance(dec, BaseException):
+            logger.debug("token refresh %s decimals error: %s", key, dec)
+            continue
+        _remember_token(key, (addr, dec))
+    logger.info("Token cache refresh: %d checked, %d resolved", len(due), len(found))
+
+async def token_cache_refresher():
+    async with aiohttp.ClientSession() as session:
+        while True:
+            await asyncio.sleep(TOKEN_REFRESH_INTERVAL)
+            try:
+                await refresh_token_cache(session)
+            except Exception as e:
+                logger.warning("token cache refresh error: %s", e)
 
 # ---------------- DEX price ----------------
-def get_router_contract(w3: Web3, router_addr: str):
-    return w3.eth.contract(address=router_addr, abi=ROUTER_ABI)
+def get_router_contract(router_addr: str):
+    contract = ROUTER_CONTRACTS.get(router_addr)
+    if contract is None:
+        contract = ROUTER_CONTRACTS[router_addr] = w3.eth.contract(address=router_addr, abi=ROUTER_ABI)
+    return contract
+
+async def aggregate3(chain: str, calls: List[Tuple[str, str]]) -> List[Optional[bytes]]:
+    # one eth_call for many (target, calldata); None for each call that reverted
+    encoded = [(target, True, bytes.fromhex(data[2:])) for target, data in calls]
+    raw = await eth_call(chain, MULTICALL3, MULTICALL.encodeABI(fn_name="aggregate3", args=[encoded]))
+    return [bytes(data) if ok else None for ok, data in w3.codec.decode(["(bool,bytes)[]"], raw)[0]]
+
+async def _run_multicall(chain: str, batch: List[Tuple[str, str, asyncio.Future]]):
+    try:
+        results = await aggregate3(chain, [(target, data) for target, data, _ in batch])
+    except Exception as e:
+        logger.warning("multicall %s (%d calls) failed: %s", chain, len(batch), e)
+        for _, _, fut in batch:
+            if not fut.done():
+                fut.set_exception(e)
+        return
+    for data, (_, _, fut) in zip(results, batch):
+        if not fut.done():
+            fut.set_result(data)
+
+async def _flush_multicall_later(chain: str):
+    await asyncio.sleep(MULTICALL_WINDOW)
+    MULTICALL_FLUSH.pop(chain, None)
+    batch = MULTICALL_PENDING.pop(chain, [])
+    if batch:
+        await _run_multicall(chain, batch)
+
+async def multicall(chain: str, target: str, calldata: str) -> Optional[bytes]:
+    # queue one eth_call for the chain's next aggregate3; None if that call reverted,
+    # raises if the whole batch failed to reach the node
+    fut = asyncio.get_running_loop().create_future()
+    pending = MULTICALL_PENDING.setdefault(chain, [])
+    pending.append((target, calldata, fut))
+    if len(pending) >= MULTICALL_BATCH_SIZE:
+        asyncio.create_task(_run_multicall(chain, MULTICALL_PENDING.pop(chain)))
+    elif chain not in MULTICALL_FLUSH:
+        MULTICALL_FLUSH[chain] = asyncio.create_task(_flush_multicall_later(chain))
+    return await fut
+
+async def _fetch_amounts_out(key: Tuple[str,str,Tuple[str,...],int]) -> Optional[List[int]]:
+    chain, router_addr, path, amount_in = key
+    router = get_router_contract(router_addr)
+    amounts = None
+    try:
+        data = await multicall(chain, router_addr, router.encodeABI(fn_name="getAmountsOut", args=[amount_in, list(path)]))
+        if data:
+            amounts = list(w3.codec.decode(["uint256[]"], data)[0])
+    except Exception as e:
+        logger.debug("DEX call error %s %s: %s", chain, path, e)
+    now = time.time()
+    if len(DEX_QUOTE_CACHE) > 4096:
+        for k in [k for k, (ts, _) in DEX_QUOTE_CACHE.items() if now - ts >= DEX_QUOTE_TTL]:
+            del DEX_QUOTE_CACHE[k]
+    # failures are cached too, so a broken pool isn't re-queried for every exchange
+    DEX_QUOTE_CACHE[key] = (now, amounts)
+    return amounts
 
-async def get_dex_price(session: aiohttp.ClientSession, symbol: str) -> Optional[float]:
+async def quote_amounts_out(chain: str, router_addr: str, path: List[str], amount_in: int) -> Optional[List[int]]:
+    key = (chain, router_addr, tuple(path), int(amount_in))
+    hit = DEX_QUOTE_CACHE.get(key)
+    fresh = bool(hit) and time.time() - hit[0] < DEX_QUOTE_TTL
+    cache_lookup("dex_quote", fresh)
+    if fresh:
+        return hit[1]
+    # coalesce concurrent callers onto one RPC
+    task = DEX_QUOTE_INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.create_task(_fetch_amounts_out(key))
+        DEX_QUOTE_INFLIGHT[key] = task
+        task.add_done_callback(lambda _t: DEX_QUOTE_INFLIGHT.pop(key, None))
+    return await asyncio.shield(task)
+
+async def resolve_dex_routes(session: aiohttp.ClientSession, symbol: str, buy: bool = False) -> Optional[Tuple[str, List[Tuple[str, List[str]]], int, int]]:
+    # (chain, [(router, path), ...], base decimals, quote decimals): the symbol's winning route in
+    # that direction while it is fresh, else the direct and one-hop paths on every router of the
+    # chain; paths always run base→quote
     try:
         base, quote = symbol.split("/")
     except Exception:
         return None
     chain = "BSC" if ("BNB" in symbol or "BUSD" in symbol) else "ETH"
-    router_addr = PANCAKE_ROUTER if chain == "BSC" else UNISWAP_ROUTER
-    w3 = w3_bsc if chain == "BSC" else w3_eth
-    base_info = await fetch_token_address(session, base, "BSC" if chain=="BSC" else "ETH")
+    base_info = await fetch_token_address(session, base, chain)
     quote_sym = quote if chain=="ETH" else (quote + "_BSC")
-    quote_info = await fetch_token_address(session, quote_sym, "BSC" if chain=="BSC" else "ETH")
+    quote_info = await fetch_token_address(session, quote_sym, chain)
     if not base_info or not quote_info:
         return None
     base_addr, base_dec = base_info
     quote_addr, quote_dec = quote_info
-    router = get_router_contract(w3, router_addr)
-    amount_in = int(1 * (10 ** base_dec))
-    def call_router():
-        return router.functions.getAmountsOut(amount_in, [base_addr, quote_addr]).call()
-    try:
-        amounts = await asyncio.to_thread(call_router)
-        if not amounts or len(amounts) < 2:
-            return None
-        amount_out = amounts[-1]
-        price = amount_out / (10 ** quote_dec)
-        await asyncio.sleep(0.06)
-        return float(price)
-    except Exception as e:
-        logger.debug("DEX call error for %s: %s", symbol, e)
+    won = DEX_ROUTES.get((symbol, buy))
+    fresh = (bool(won) and time.time() - won[0] < DEX_ROUTE_TTL and won[1] == chain
+             and won[3][0].lower() == base_addr.lower() and won[3][-1].lower() == quote_addr.lower())
+    cache_lookup("dex_route", fresh)
+    if fresh:
+        return chain, [(won[2], list(won[3]))], base_dec, quote_dec
+    paths = [[base_addr, quote_addr]]
+    if DEX_MULTI_HOP:
+        for hub in DEX_HOP_TOKENS[chain]:
+            hub_addr = TOKEN_MAP[hub][chain.lower()]
+            if hub_addr.lower() not in (base_addr.lower(), quote_addr.lower()):
+                paths.append([base_addr, hub_addr, quote_addr])
+    return chain, [(router, path) for router in DEX_ROUTERS[chain] for path in paths], base_dec, quote_dec
+
+def dex_route_label(symbol: str, buy: bool = False) -> Optional[str]:
+    # "PancakeSwap" / "BiSwap via WBNB" for the symbol's current winning route in that direction
+    won = DEX_ROUTES.get((symbol, buy))
+    if not won:
         return None
+    _, chain, router, path = won
+    label = ROUTER_NAMES.get(router, router[:10])
+    if len(path) > 2:
+        names = {info[chain.lower()].lower(): sym.partition("_")[0] for sym, info in TOKEN_MAP.items() if chain.lower() in info}
+        label += " via " + "/".join(names.get(a.lower(), a[:10]) for a in path[1:-1])
+    return label
 
-# ---------------- gas estimate ----------------
-async def update_gas_fees(session: aiohttp.ClientSession):
-    global LAST_GAS_UPDATE, GAS_FEES_USD
+async def quote_dex_prices(session: aiohttp.ClientSession, syms: List[str], ref_prices: Dict[str, float],
+                           buy: bool = False) -> Dict[str, float]:
+    # DEX price per symbol for a trade of MY_CAPITAL_USD (1 token without a reference price) in the
+    # trade's direction: selling base for quote, or with buy=True spending quote on base; the best
+    # output over the candidate routes wins. Mirrored pools are priced locally, the rest are quoted
+    # live and share the chain's aggregate3 batches
+    resolved = await asyncio.gather(*(resolve_dex_routes(session, sym, buy) for sym in syms))
+    if buy:
+        sizes = {sym: MY_CAPITAL_USD if MY_CAPITAL_USD > 0 else (ref_prices.get(sym) or 1.0) for sym in syms}
+    else:
+        sizes = {sym: (MY_CAPITAL_USD / ref_prices[sym]) if ref_prices.get(sym) and MY_CAPITAL_USD > 0 else 1.0 for sym in syms}
+    # one row per (symbol, route): (sym, chain, router, path in trade order, base decimals, quote decimals)
+    cands: List[Tuple[str, str, str, List[str], int, int]] = []
+    for sym, res in zip(syms, resolved):
+        if res:
+            chain, routes, base_dec, quote_dec = res
+            cands.extend((sym, chain, router, path[::-1] if buy else path, base_dec, quote_dec) for router, path in routes)
+    if not cands:
+        return {}
+    amounts_in = np.array([sizes[sym] * 10.0 ** (quote_dec if buy else base_dec) for sym, _, _, _, base_dec, quote_dec in cands])
+    amounts_out = np.full(len(cands), np.nan)
+    live = list(range(len(cands)))
+    if RESERVE_MIRROR:
+        try:
+            hops = await mirror_prepare([(chain, router, path) for _, chain, router, path, _, _ in cands])
+        except Exception as e:
+            logger.warning("reserve mirror prepare failed: %s", e)
+            hops = [None] * len(cands)
+        local = [k for k, h in enumerate(hops) if h]
+        for h in hops:
+            cache_lookup("reserve_mirror", bool(h))
+        if local:
+            amounts_out[local] = mirror_amounts_out([hops[k] for k in local], amounts_in[local])
+        # a hop with no pool behind the router's factory would only revert live
+        live = [k for k, h in enumerate(hops) if not h and not mirror_route_missing(*cands[k][1:4])]
+    quoted = await asyncio.gather(*(quote_amounts_out(cands[k][1], cands[k][2], cands[k][3], int(amounts_in[k])) for k in live))
+    for k, amounts in zip(live, quoted):
+        if amounts and len(amounts) >= 2:
+            amounts_out[k] = amounts[-1]
+    best: Dict[str, int] = {}
+    for k, cand in enumerate(cands):
+        a = amounts_out[k]
+        if np.isfinite(a) and a > 0 and (cand[0] not in best or a > amounts_out[best[cand[0]]]):
+            best[cand[0]] = k
     now = time.time()
-    if LAST_GAS_UPDATE and (now - LAST_GAS_UPDATE) < GAS_UPDATE_INTERVAL and GAS_FEES_USD["ETH"] is not None:
+    out: Dict[str, float] = {}
+    for sym, res in zip(syms, resolved):
+        k = best.get(sym)
+        if k is None:
+            DEX_ROUTES.pop((sym, buy), None)  # the cached route stopped quoting: compare all routes next time
+            continue
+        _, chain, router, path, base_dec, quote_dec = cands[k]
+        if buy:
+            out[sym] = float((amounts_in[k] / 10.0 ** quote_dec) / (amounts_out[k] / 10.0 ** base_dec))
+            path = path[::-1]
+        else:
+            out[sym] = float((amounts_out[k] / 10.0 ** quote_dec) / (amounts_in[k] / 10.0 ** base_dec))
+        won = DEX_ROUTES.get((sym, buy))
+        if len(res[1]) > 1 or not won:
+            DEX_ROUTES[(sym, buy)] = (now, chain, router, tuple(path))
+            if len(path) > 2 or router != DEX_ROUTERS[chain][0]:
+                logger.debug("DEX %s route %s: %s", "buy" if buy else "sell", sym, dex_route_label(sym, buy))
+    return out
+
+# ---------------- V2 reserve mirror ----------------
+# Pools are found (getPair) and loaded (getReserves) once through Multicall3, then kept
+# current from Sync logs; amountOut is computed locally with x*y=k and the pool fee.
+def _mirror_add(chain: str, pair: str, token0: str, fee_mult: float, r0: int, r1: int, block: int) -> int:
+    global PAIR_RESERVES, PAIR_FEE_MULT
+    idx = len(PAIR_ADDR)
+    if idx >= len(PAIR_RESERVES):
+        cap = max(64, 2 * len(PAIR_RESERVES))
+        PAIR_RESERVES = np.vstack([PAIR_RESERVES, np.zeros((cap - len(PAIR_RESERVES), 2))])
+        PAIR_FEE_MULT = np.concatenate([PAIR_FEE_MULT, np.zeros(cap - len(PAIR_FEE_MULT))])
+    PAIR_ADDR.append(pair); PAIR_CHAIN.append(chain); PAIR_TOKEN0.append(token0); PAIR_BLOCK.append(block)
+    PAIR_BY_ADDR[(chain, pair.lower())] = idx
+    PAIR_RESERVES[idx] = (r0, r1)
+    PAIR_FEE_MULT[idx] = fee_mult
+    return idx
+
+async def _load_reserves(chain: str, pairs: List[str]) -> Tuple[int, List[Optional[Tuple[int,int]]]]:
+    # block number is read in the same aggregate3, so reserves and block are consistent
+    block = None
+    reserves: List[Optional[Tuple[int,int]]] = []
+    for chunk in _chunks(pairs, 500):
+        res = await aggregate3(chain, [(MULTICALL3, BLOCK_NUMBER_CALL)] + [(p, V2_PAIR.encodeABI(fn_name="getReserves")) for p in chunk])
+        b = w3.codec.decode(["uint256"], res[0])[0]
+        block = b if block is None else min(block, b)
+        for data in res[1:]:
+            reserves.append(tuple(w3.codec.decode(["uint112","uint112","uint32"], data)[:2]) if data else None)
+    return block or 0, reserves
+
+async def mirror_prepare(routes: List[Tuple[str, str, List[str]]]) -> List[Optional[List[Tuple[int,bool]]]]:
+    async with MIRROR_LOCK:
+        # discover pools for hops we haven't seen yet
+        # and re-check "no pool" answers once they expire, since pools get created later
+        wanted: Dict[Tuple[str,str,str,str], int] = {}
+        for chain, router, path in routes:
+            factory = ROUTER_FACTORY.get(router)
+            if not factory or (chain, router, tuple(path)) in MIRROR_ROUTES:
+                continue
+            for a, b in zip(path, path[1:]):
+                t0, t1 = sorted((a, b), key=lambda x: int(x, 16))
+                key = (chain, factory, t0, t1)
+                if key not in PAIR_INDEX or (PAIR_INDEX[key] < 0 and not _pair_missing(key)):
+                    wanted[key] = ROUTER_FEE_BPS.get(router, 30)
+        if wanted:
+            keys = list(wanted)
+            found = await asyncio.gather(*(multicall(c, f, V2_FACTORY.encodeABI(fn_name="getPair", args=[t0, t1])) for c, f, t0, t1 in keys))
+            by_chain: Dict[str, List[Tuple[Tuple[str,str,str,str], str]]] = {}
+            for key, data in zip(keys, found):
+                pair = w3.codec.decode(["address"], data)[0] if data else None
+                if not pair or int(pair, 16) == 0:
+                    PAIR_INDEX[key] = -1
+                    PAIR_MISSING_AT[key] = time.time()
+                else:
+                    by_chain.setdefault(key[0], []).append((key, Web3.to_checksum_address(pair)))
+            for chain, items in by_chain.items():
+                block, reserves = await _load_reserves(chain, [p for _, p in items])
+                for (key, pair), res in zip(items, reserves):
+                    if res is None:
+                        PAIR_INDEX[key] = -1
+                        PAIR_MISSING_AT[key] = time.time()
+                        continue
+                    idx = PAIR_BY_ADDR.get((chain, pair.lower()))
+                    if idx is None:
+                        idx = _mirror_add(chain, pair, key[2], 1 - wanted[key] / 10000, res[0], res[1], block)
+                    PAIR_INDEX[key] = idx
+                    PAIR_MISSING_AT.pop(key, None)
+                MIRROR_FROM_BLOCK.setdefault(chain, block + 1)
+                MIRROR_SYNCED_AT.setdefault(chain, time.time())
+                logger.info("Reserve mirror %s: +%d pools (%d total)", chain, len(items), len(PAIR_ADDR))
+        out: List[Optional[List[Tuple[int,bool]]]] = []
+        for chain, router, path in routes:
+            rkey = (chain, router, tuple(path))
+            hops = MIRROR_ROUTES.get(rkey)
+            if hops is None:
+                factory = ROUTER_FACTORY.get(router)
+                hops = [] if factory else None
+                for a, b in zip(path, path[1:]):
+                    t0, t1 = sorted((a, b), key=lambda x: int(x, 16))
+                    idx = PAIR_INDEX.get((chain, factory, t0, t1), -1) if factory else -1
+                    if idx < 0:
+                        hops = None
+                        break
+                    hops.append((idx, a.lower() == t0.lower()))
+                if hops is not None:
+                    MIRROR_ROUTES[rkey] = hops
+            # a chain whose Sync polling has stalled is quoted live until it catches up
+            out.append(hops if hops is not None and mirror_fresh(chain) else None)
+        return out
+
+def _pair_missing(key: Tuple[str,str,str,str]) -> bool:
+    # a recent "no pool" answer for (chain, factory, token0, token1)
+    return PAIR_INDEX.get(key) == -1 and time.time() - PAIR_MISSING_AT.get(key, 0.0) < RESERVE_MISSING_TTL
+
+def mirror_fresh(chain: str) -> bool:
+    return time.time() - MIRROR_SYNCED_AT.get(chain, 0.0) < RESERVE_STALE_AFTER
+
+def mirror_route_missing(chain: str, router: str, path: List[str]) -> bool:
+    # some hop of the path recently had no pool at the router's factory (getPair returned 0)
+    factory = ROUTER_FACTORY.get(router)
+    if not factory:
+        return False
+    for a, b in zip(path, path[1:]):
+        t0, t1 = sorted((a, b), key=lambda x: int(x, 16))
+        if _pair_missing((chain, factory, t0, t1)):
+            return True
+    return False
+
+def mirror_amounts_out(routes: List[List[Tuple[int,bool]]], amounts_in: np.ndarray) -> np.ndarray:
+    # amountOut for every route at once; hop h of all routes is evaluated in one vector step
+    n_hops = max(len(r) for r in routes)
+    idx = np.zeros((len(routes), n_hops), dtype=np.int64)
+    zero_for_one = np.zeros((len(routes), n_hops), dtype=bool)
+    has_hop = np.zeros((len(routes), n_hops), dtype=bool)
+    for k, route in enumerate(routes):
+        for h, (pid, z) in enumerate(route):
+            idx[k, h] = pid; zero_for_one[k, h] = z; has_hop[k, h] = True
+    amt = np.asarray(amounts_in, dtype=float)
+    for h in range(n_hops):
+        i = idx[:, h]
+        r0 = PAIR_RESERVES[i, 0]; r1 = PAIR_RESERVES[i, 1]
+        r_in = np.where(zero_for_one[:, h], r0, r1)
+        r_out = np.where(zero_for_one[:, h], r1, r0)
+        a = amt * PAIR_FEE_MULT[i]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            hop_out = a * r_out / (r_in + a)
+        amt = np.where(has_hop[:, h], hop_out, amt)
+    return amt
+
+async def mirror_reload(chain: str):
+    ids = [i for i, c in enumerate(PAIR_CHAIN) if c == chain]
+    block, reserves = await _load_reserves(chain, [PAIR_ADDR[i] for i in ids])
+    for i, res in zip(ids, reserves):
+        if res is not None:
+            PAIR_RESERVES[i] = res
+            PAIR_BLOCK[i] = block
+    MIRROR_FROM_BLOCK[chain] = block + 1
+    MIRROR_SYNCED_AT[chain] = time.time()
+    logger.info("Reserve mirror %s: reloaded %d pools at block %d", chain, len(ids), block)
+
+async def mirror_poll(chain: str):
+    ids = [i for i, c in enumerate(PAIR_CHAIN) if c == chain]
+    if not ids:
+        return
+    head = int(await rpc_request(chain, "eth_blockNumber", []), 16)
+    start = MIRROR_FROM_BLOCK.get(chain, head + 1)
+    if head < start:
+        MIRROR_SYNCED_AT[chain] = time.time()
         return
-    eth_gwei = None; bnb_gwei = None; eth_price = None; bnb_price = None
+    if head - start > RESERVE_MAX_LOG_BLOCKS:
+        await mirror_reload(chain)
+        return
+    applied = 0
+    for chunk in _chunks([PAIR_ADDR[i] for i in ids], 500):
+        logs = await rpc_request(chain, "eth_getLogs", [{"fromBlock": hex(start), "toBlock": hex(head), "address": chunk, "topics": [SYNC_TOPIC]}])
+        # logs come in block order, so the last Sync per pool wins
+        for log in logs or []:
+            idx = PAIR_BY_ADDR.get((chain, log["address"].lower()))
+            if idx is None or int(log["blockNumber"], 16) <= PAIR_BLOCK[idx]:
+                continue
+            PAIR_RESERVES[idx] = w3.codec.decode(["uint112","uint112"], bytes.fromhex(log["data"][2:]))
+            applied += 1
+    MIRROR_FROM_BLOCK[chain] = head + 1
+    MIRROR_SYNCED_AT[chain] = time.time()
+    logger.debug("Reserve mirror %s: %d Sync events up to block %d", chain, applied, head)
+
+async def reserve_mirror_loop():
+    while True:
+        await asyncio.sleep(RESERVE_POLL_INTERVAL)
+        for chain in set(PAIR_CHAIN):
+            try:
+                await mirror_poll(chain)
+            except Exception as e:
+                logger.warning("reserve mirror poll %s error: %s", chain, e)
+            if mirror_fresh(chain):
+                continue
+            # logs keep failing: reload reserves by eth_call, which needs no getLogs support
+            try:
+                await mirror_reload(chain)
+            except Exception as e:
+                logger.warning("reserve mirror reload %s error: %s", chain, e)
+
+# ---------------- gas estimate ----------------
+# Gas price comes from the chain (next block's base fee + typical tip), smoothed with an
+# EWMA; the native coin price from our own CEX tickers, CoinGecko when none is listed.
+# update_gas_fees() runs as the "gas" job, so the checks only ever read GAS_FEES_USD.
+GAS_NATIVE = {
+    "ETH": ("ETH/USDT", "ethereum", ETH_GWEI_FALLBACK, ETH_PRICE_FALLBACK),
+    "BSC": ("BNB/USDT", "binancecoin", BNB_GWEI_FALLBACK, BNB_PRICE_FALLBACK),
+}
+
+async def fetch_gas_gwei(chain: str) -> Optional[float]:
+    try:
+        hist = await rpc_request(chain, "eth_feeHistory", [hex(GAS_FEE_HISTORY_BLOCKS), "latest", [GAS_TIP_PERCENTILE]])
+        base = int(hist["baseFeePerGas"][-1], 16)  # next block's base fee
+        tips = [int(r[0], 16) for r in hist.get("reward") or [] if r]
+        return (base + (sorted(tips)[len(tips) // 2] if tips else 0)) / 1e9
+    except Exception as e:
+        logger.debug("eth_feeHistory %s failed (%s), trying eth_gasPrice", chain, e)
+    try:
+        return int(await rpc_request(chain, "eth_gasPrice", []), 16) / 1e9
+    except Exception as e:
+        logger.warning("gas price %s unavailable: %s", chain, e)
+        return None
+
+async def native_price_usd(session: aiohttp.ClientSession, chain: str) -> float:
+    sym, coin_id, _, fallback = GAS_NATIVE[chain]
+    store = LATEST_STORE
+    sid = SYMBOL_IDS.get(sym)
+    if store is not None and sid is not None and sid < store["last"].shape[0]:
+        lasts = store["last"][sid][store["last"][sid] > 0]
+        if len(lasts):
+            return float(lasts.mean())
+    cached = NATIVE_PRICE_USD.get(chain)
+    if cached and time.time() - cached[0] < NATIVE_PRICE_TTL:
+        return cached[1]
     try:
-        async with session.get(f"{COINGECKE_API}/simple/price?ids=ethereum,binancecoin&vs_currencies=usd") as r:
+        async with session.get(f"{COINGECKE_API}/simple/price?ids={coin_id}&vs_currencies=usd") as r:
             if r.status == 200:
-                d = await r.json()
-                eth_price = d.get("ethereum", {}).get("usd", ETH_PRICE_FALLBACK)
-                bnb_price = d.get("binancecoin", {}).get("usd", BNB_PRICE_FALLBACK)
-    except Exception:
-        pass
-    eth_gwei = eth_gwei or ETH_GWEI_FALLBACK
-    bnb_gwei = bnb_gwei or BNB_GWEI_FALLBACK
-    eth_price = eth_price or ETH_PRICE_FALLBACK
-    bnb_price = bnb_price or BNB_PRICE_FALLBACK
-    GAS_FEES_USD["ETH"] = eth_gwei * 1e-9 * GAS_UNITS_SWAP * eth_price
-    GAS_FEES_USD["BNB"] = bnb_gwei * 1e-9 * GAS_UNITS_SWAP * bnb_price
-    LAST_GAS_UPDATE = now
-    logger.info("Gas est: ETH $%.2f, BNB $%.2f", GAS_FEES_USD["ETH"], GAS_FEES_USD["BNB"])
+                price = (await r.json()).get(coin_id, {}).get("usd")
+                if price:
+                    NATIVE_PRICE_USD[chain] = (time.time(), float(price))
+                    return float(price)
+    except Exception as e:
+        logger.debug("CoinGecko %s price error: %s", coin_id, e)
+    return cached[1] if cached else fallback
 
-# ---------------- snapshots ----------------
-async def build_tickers_snapshot() -> Dict[str, Dict[str, dict]]:
-    out: Dict[str, Dict[str, dict]] = {}
-    for name, client in EXCHANGES.items():
-        if not ENABLED_EXCHANGES.get(name, False):
-            continue
+async def update_gas_fees(session: aiohttp.ClientSession):
+    global LAST_GAS_UPDATE
+    chains = list(GAS_NATIVE)
+    readings = await asyncio.gather(*(fetch_gas_gwei(chain) for chain in chains))
+    for chain, gwei in zip(chains, readings):
+        prev = GAS_GWEI.get(chain)
+        if gwei is not None:
+            GAS_GWEI[chain] = gwei if prev is None else prev + GAS_EWMA_ALPHA * (gwei - prev)
+        elif prev is None:
+            GAS_GWEI[chain] = GAS_NATIVE[chain][2]
+        price = await native_price_usd(session, chain)
+        GAS_FEES_USD[chain] = GAS_GWEI[chain] * 1e-9 * GAS_UNITS_SWAP * price
+        metric_set("arb_gas_gwei", GAS_GWEI[chain], chain=chain)
+        metric_set("arb_gas_swap_usd", GAS_FEES_USD[chain], chain=chain)
+    LAST_GAS_UPDATE = time.time()
+    record("gas", dict(GAS_FEES_USD), LAST_GAS_UPDATE)
+    logger.info("Gas est: %s", ", ".join(f"{c} {GAS_GWEI[c]:.2f} gwei ${GAS_FEES_USD[c]:.2f}" for c in chains))
+
+# ---------------- exchange registry ----------------
+# ccxt clients are built from EXCHANGE_CONFIG only when a venue is first used, so venues
+# that stay switched off cost nothing at startup; /enable can add any ccxt exchange id.
+def register_exchange(name: str) -> bool:
+    name = name.lower()
+    if name not in EXCHANGE_CONFIG:
+        if name not in ccxt.exchanges:
+            return False
+        EXCHANGE_CONFIG[name] = {"enabled": False}
+    ENABLED_EXCHANGES.setdefault(name, False)
+    return True
+
+def exchange_client(name: str) -> ccxt.Exchange:
+    client = EXCHANGES.get(name)
+    if client is None:
+        cfg = EXCHANGE_CONFIG.get(name) or {}
+        params = {"enableRateLimit": True}
+        if cfg.get("options"):
+            params["options"] = cfg["options"]
+        if cfg.get("rate_limit_ms"):
+            params["rateLimit"] = cfg["rate_limit_ms"]
+        client = EXCHANGES[name] = getattr(ccxt, cfg.get("ccxt_id", name))(params)
+        ORDERBOOK_LIMITS[name] = asyncio.Semaphore(int(cfg.get("max_inflight", ORDERBOOK_MAX_INFLIGHT)))
+        # markets from the boot snapshot, so the first fetch doesn't wait for load_markets()
+        snap = read_boot_snapshot(f"markets_{name}")
+        if snap and snap.get("markets"):
+            try:
+                client.set_markets(snap["markets"], snap.get("currencies") or None)
+                MARKETS_WARM.add(name)
+            except Exception as e:
+                logger.warning("markets snapshot %s rejected: %s", name, e)
+    return client
+
+async def release_exchange_client(name: str):
+    # a switched-off venue gives back its sessions and markets
+    client = EXCHANGES.pop(name, None)
+    MARKETS_WARM.discard(name)
+    CROSS_BOOK.pop(name, None)
+    if client is not None:
         try:
-            tks = await client.fetch_tickers()
-            if tks:
-                # filter USDT spot pairs
-                out[name] = {s:t for s,t in tks.items() if s.endswith("/USDT")}
-            else:
-                out[name] = {}
-            await asyncio.sleep(0.2)
+            await client.close()
         except Exception as e:
-            logger.debug("fetch_tickers %s error: %s", name, e)
-            out[name] = {}
-    return out
+            logger.debug("close %s error: %s", name, e)
+
+def enabled_exchanges() -> List[str]:
+    return [name for name, on in ENABLED_EXCHANGES.items() if on]
+
+def market_filter(name: str):
+    # (quote currencies, include patterns, exclude patterns) for compact_tickers()
+    cfg = EXCHANGE_CONFIG.get(name) or {}
+    return tuple(q.upper() for q in cfg.get("quotes") or ["USDT"]), tuple(cfg.get("include") or ()), tuple(cfg.get("exclude") or ())
+
+# ---------------- ticker store ----------------
+# A snapshot is kept as parallel float matrices (symbols × exchanges) for bid, ask, last
+# and 24h quote volume; rows are interned symbol ids, NaN = not listed / no quote.
+#   {"exchanges": [...], "ts": float, "bid": ndarray, "ask": ndarray, "last": ndarray, "qvol": ndarray}
+TICKER_FIELDS = ("bid", "ask", "last", "qvol")
+
+def intern_symbol(sym: str) -> int:
+    sid = SYMBOL_IDS.get(sym)
+    if sid is None:
+        sid = SYMBOL_IDS[sym] = len(SYMBOLS)
+        SYMBOLS.append(sym)
+    return sid
+
+def compact_tickers(tks: Dict[str, dict], quotes: Tuple[str, ...] = ("USDT",), include: Tuple[str, ...] = (),
+                    exclude: Tuple[str, ...] = ()) -> Tuple[np.ndarray, np.ndarray]:
+    # ccxt tickers -> (symbol ids, values[n, len(TICKER_FIELDS)]); spot pairs in the given quotes only
+    ids: List[int] = []
+    vals: List[tuple] = []
+    for sym, t in tks.items():
+        if not t or ":" in sym or sym.rpartition("/")[2] not in quotes:
+            continue
+        if include and not any(fnmatch.fnmatchcase(sym, p) for p in include):
+            continue
+        if exclude and any(fnmatch.fnmatchcase(sym, p) for p in exclude):
+            continue
+        last = t.get("last")
+        qvol = t.get("quoteVolume") or (t.get("baseVolume") or 0) * (last or 0)
+        ids.append(intern_symbol(sym))
+        vals.append((t.get("bid"), t.get("ask"), last, qvol))
+    return np.array(ids, dtype=np.int64), np.array(vals, dtype=float).reshape(-1, len(TICKER_FIELDS))
+
+def new_ticker_store(names: List[str], ts: float) -> dict:
+    store = {"exchanges": list(names), "ts": ts}
+    for f in TICKER_FIELDS:
+        store[f] = np.full((len(SYMBOLS), len(names)), np.nan)
+    return store
+
+def ticker_store_from_columns(columns: Dict[str, Tuple[np.ndarray, np.ndarray]], ts: float) -> dict:
+    names = list(columns)
+    store = new_ticker_store(names, ts)
+    for j, name in enumerate(names):
+        ids, vals = columns[name]
+        for k, f in enumerate(TICKER_FIELDS):
+            store[f][ids, j] = vals[:, k]
+    return store
+
+def ticker_store_from_dicts(tickers_by_ex: Dict[str, Dict[str, dict]], ts: Optional[float] = None) -> dict:
+    # for raw ccxt-shaped snapshots (recordings, tests)
+    return ticker_store_from_columns({name: compact_tickers(tks) for name, tks in tickers_by_ex.items()}, ts or time.time())
+
+def store_rows(store: dict, symbols: Optional[Iterable[str]] = None) -> np.ndarray:
+    # row ids present in the store, optionally restricted to symbols
+    n = store["bid"].shape[0]
+    if symbols is None:
+        return np.arange(n)
+    return np.array(sorted(i for i in (SYMBOL_IDS.get(s) for s in symbols) if i is not None and i < n), dtype=np.int64)
+
+# ---------------- snapshot deltas ----------------
+# Each REST store carries the rows that changed against the one before it, so the checks can
+# rescan those and reuse their cached results for everything else.
+#   store["dirty"]: row ids, or None = evaluate everything; store["prev_ts"]: the baseline's ts
+def store_delta(prev: Optional[dict], store: dict) -> Optional[np.ndarray]:
+    # rows whose bid/ask moved, appeared/vanished on a venue or crossed the volume floor
+    if prev is None or prev["exchanges"] != store["exchanges"]:
+        return None
+    m = min(prev["bid"].shape[0], store["bid"].shape[0])
+    changed = np.ones(store["bid"].shape[0], dtype=bool)
+    moved = np.zeros((m, len(store["exchanges"])), dtype=bool)
+    for f in ("bid", "ask"):
+        a, b = prev[f][:m], store[f][:m]
+        moved |= (a != b) & ~(np.isnan(a) & np.isnan(b))
+    moved |= (np.nan_to_num(prev["qvol"][:m], nan=0.0) >= MIN_VOLUME_24H) != (np.nan_to_num(store["qvol"][:m], nan=0.0) >= MIN_VOLUME_24H)
+    changed[:m] = moved.any(axis=1)
+    return np.flatnonzero(changed)
+
+def mark_dirty(store: dict):
+    global PREV_TICKERS
+    prev = PREV_TICKERS
+    store["dirty"] = store_delta(prev, store) if DELTA_EVAL else None
+    store["prev_ts"] = prev["ts"] if prev is not None else None
+    PREV_TICKERS = store
+    if store["dirty"] is not None:
+        metric_set("arb_delta_dirty_rows", len(store["dirty"]))
+
+# ---------------- snapshots ----------------
+async def fetch_exchange_tickers(name: str, client: ccxt.Exchange) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    t0 = time.monotonic()
+    try:
+        tks = await asyncio.wait_for(client.fetch_tickers(), timeout=TICKERS_FETCH_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("fetch_tickers %s timed out after %.1fs", name, TICKERS_FETCH_TIMEOUT)
+        metric_inc("arb_tickers_fetch_errors_total", exchange=name, reason="timeout")
+        return None
+    except Exception as e:
+        logger.debug("fetch_tickers %s error: %s", name, e)
+        metric_inc("arb_tickers_fetch_errors_total", exchange=name, reason="error")
+        return None
+    metric_observe("arb_tickers_fetch_seconds", time.monotonic() - t0, exchange=name)
+    if TRIANGULAR and tks:
+        update_cross_book(name, tks)
+    # keep only the columns the checks read; the full ticker dicts are dropped here
+    return compact_tickers(tks or {}, *market_filter(name))
+
+async def build_tickers_snapshot() -> dict:
+    global SNAPSHOT_TS, SNAPSHOT_MISSING
+    names = enabled_exchanges()
+    started = time.time()
+    results = await asyncio.gather(*(fetch_exchange_tickers(name, exchange_client(name)) for name in names))
+    columns: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    missing: List[str] = []
+    for name, cols in zip(names, results):
+        if cols is None:
+            missing.append(name)
+        else:
+            columns[name] = cols
+    SNAPSHOT_TS = started
+    SNAPSHOT_MISSING = missing
+    if missing:
+        logger.warning("Tickers snapshot partial (%.2fs): missing %s", time.time() - started, ", ".join(missing))
+    else:
+        logger.info("Tickers snapshot (%.2fs): %s", time.time() - started, ", ".join(f"{k}={len(v[0])}" for k,v in columns.items()))
+    store = ticker_store_from_columns(columns, started)
+    mark_dirty(store)
+    record("tickers", store, started)
+    return store
+
+async def fetch_exchange_funding(name: str, client: ccxt.Exchange) -> Optional[dict]:
+    if not client.has.get("fetchFundingRates"):
+        return None
+    t0 = time.monotonic()
+    try:
+        rates = await asyncio.wait_for(client.fetch_funding_rates(), timeout=FUNDING_FETCH_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("fetch_funding_rates %s timed out after %.1fs", name, FUNDING_FETCH_TIMEOUT)
+        metric_inc("arb_funding_fetch_errors_total", exchange=name, reason="timeout")
+        return None
+    except Exception as e:
+        logger.debug("fetch_funding_rates %s error: %s", name, e)
+        metric_inc("arb_funding_fetch_errors_total", exchange=name, reason="error")
+        return None
+    metric_observe("arb_funding_fetch_seconds", time.monotonic() - t0, exchange=name)
+    if not rates or len(rates) < 10:
+        logger.debug("Low/no funding rates for %s, skip", name)
+        return None
+    return rates
 
 async def build_funding_snapshot() -> Dict[str, dict]:
-    out: Dict[str, dict] = {}
-    for name, client in EXCHANGES.items():
-        if not ENABLED_EXCHANGES.get(name, False):
+    names = enabled_exchanges()
+    results = await asyncio.gather(*(fetch_exchange_funding(name, exchange_client(name)) for name in names))
+    return {name: rates for name, rates in zip(names, results) if rates}
+
+async def refresh_funding_snapshot():
+    # one funding snapshot for everyone, on its own cadence and off the spot scan's path
+    global FUNDING_SNAPSHOT, FUNDING_SNAPSHOT_TS
+    started = time.time()
+    with stage_timer("funding_fetch"):
+        snap = await build_funding_snapshot()
+    if snap:
+        FUNDING_SNAPSHOT = snap
+        FUNDING_SNAPSHOT_TS = started
+        record("funding", {ex: {perp: fr.get("fundingRate") for perp, fr in rates.items() if fr} for ex, rates in snap.items()}, started)
+        logger.info("Funding snapshot (%.2fs): %s", time.time() - started, ", ".join(f"{k}={len(v)}" for k,v in snap.items()))
+
+# ---------------- spread engine ----------------
+# Each symbol is scanned once across all venues for the lowest ask (buy) and the highest
+# bid (sell), so work stays O(symbols × venues) and stale `last` prints can't fake a spread.
+def cex_cex_scan(store: dict, rows: Optional[np.ndarray] = None, min_eff: Optional[float] = None) -> np.ndarray:
+    # compact records, one row per symbol with eff_pct >= min_eff (MIN_EFF_SPREAD_PERCENT), best first:
+    # [symbol row, buy column, sell column, buy_ask, sell_bid, buy_qvol, sell_qvol, raw_pct, eff_pct, n_venues]
+    names = store["exchanges"]
+    if rows is None:
+        rows = np.arange(store["bid"].shape[0])
+    if len(names) < 2 or not len(rows):
+        return np.zeros((0, 10))
+    bid = store["bid"][rows]; ask = store["ask"][rows]; qvol = store["qvol"][rows]
+    enabled = np.array([ENABLED_EXCHANGES.get(n, False) for n in names])
+    vol_ok = (qvol >= MIN_VOLUME_24H) & enabled
+    can_buy = vol_ok & (ask > 0)
+    can_sell = vol_ok & (bid > 0)
+    n_live = (can_buy | can_sell).sum(axis=1)
+    ib = np.where(can_buy, ask, np.inf).argmin(axis=1)
+    isl = np.where(can_sell, bid, -np.inf).argmax(axis=1)
+    k = np.arange(len(rows))
+    lo = ask[k, ib]; hi = bid[k, isl]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        raw = (hi - lo) / ((hi + lo) / 2) * 100
+    # same cost model as effective_after_costs(raw, True, buy_ex, ex_name_b=sell_ex)
+    fee = np.array([cex_fee_pct(n) for n in names])
+    eff = raw - (fee[ib] + fee[isl] + EST_SLIPPAGE_PCT)
+    threshold = MIN_EFF_SPREAD_PERCENT if min_eff is None else min_eff
+    ok = np.flatnonzero(can_buy[k, ib] & can_sell[k, isl] & (ib != isl) & np.isfinite(eff) & (eff >= threshold))
+    ok = ok[np.argsort(-eff[ok], kind="stable")]
+    return np.column_stack([np.asarray(rows)[ok], ib[ok], isl[ok], lo[ok], hi[ok], qvol[ok, ib[ok]], qvol[ok, isl[ok]],
+                            raw[ok], eff[ok], n_live[ok]]).astype(float).reshape(-1, 10)
+
+def cex_cex_opps(store: dict, recs: np.ndarray) -> List[tuple]:
+    # records -> (sym, buy_ex, sell_ex, buy_ask, sell_bid, buy_qvol, sell_qvol, raw_pct, eff_pct, n_venues)
+    names = store["exchanges"]
+    return [(SYMBOLS[int(r[0])], names[int(r[1])], names[int(r[2])], float(r[3]), float(r[4]), float(r[5]), float(r[6]),
+             float(r[7]), float(r[8]), int(r[9])) for r in recs]
+
+def cex_cex_delta_scan(store: dict, min_eff: Optional[float] = None) -> Optional[np.ndarray]:
+    # scan only the store's dirty rows and keep the cached records of the others; None when
+    # the cache doesn't belong to the store's baseline (or too much moved) and a full scan is due
+    dirty, cache = store.get("dirty"), CEX_CEX_CACHE
+    if dirty is None or cache["recs"] is None or cache["ts"] != store.get("prev_ts") or cache["exchanges"] != store["exchanges"]:
+        return None
+    n = store["bid"].shape[0]
+    if len(dirty) > DELTA_FULL_RATIO * n or cache["params"] != (_shard_params(), min_eff, MIN_EFF_SPREAD_PERCENT):
+        return None
+    kept = cache["recs"][~np.isin(cache["recs"][:, 0], dirty)].copy()
+    if len(kept):
+        # prices are unchanged by definition; 24h volumes drift, so refresh them
+        r, b, s = kept[:, 0].astype(np.int64), kept[:, 1].astype(np.int64), kept[:, 2].astype(np.int64)
+        kept[:, 5] = store["qvol"][r, b]; kept[:, 6] = store["qvol"][r, s]
+    recs = np.concatenate([kept, cex_cex_scan(store, dirty, min_eff)])
+    metric_inc("arb_delta_rows_total", len(dirty), check="cex_cex", result="scanned")
+    metric_inc("arb_delta_rows_total", n - len(dirty), check="cex_cex", result="reused")
+    return recs[np.argsort(-recs[:, 8], kind="stable")]
+
+# ---------------- scan shards ----------------
+# The coordinator (this process) fetches, owns Telegram, depth and DEX quoting; the
+# CEX↔CEX scan of a full store is split by symbol range across SCAN_SHARDS spawned
+# workers. Each cycle the store goes into one shared-memory block, workers read their
+# rows in place and send back compact cex_cex_scan() records over a queue.
+def _shard_params() -> dict:
+    return {"enabled": dict(ENABLED_EXCHANGES), "fees": {name: cex_fee_pct(name) for name in ENABLED_EXCHANGES}, "fee_default": CEX_FEE_DEFAULT_PCT,
+            "min_volume": MIN_VOLUME_24H, "slippage": EST_SLIPPAGE_PCT}
+
+def _apply_shard_params(params: dict):
+    global CEX_FEE_DEFAULT_PCT, MIN_VOLUME_24H, EST_SLIPPAGE_PCT
+    ENABLED_EXCHANGES.clear(); ENABLED_EXCHANGES.update(params["enabled"])
+    CEX_FEES_OVERRIDE.clear(); CEX_FEES_OVERRIDE.update(params["fees"])
+    CEX_FEE_DEFAULT_PCT = params["fee_default"]
+    MIN_VOLUME_24H = params["min_volume"]
+    EST_SLIPPAGE_PCT = params["slippage"]
+
+def shard_worker(shard: int, tasks, results):
+    # runs in a spawned process: (cycle, shm name, shape, exchanges, lo, hi, min_eff, params);
+    # records carry row ids, so the worker needs no symbol table
+    logger.info("scan shard %d started (pid %d)", shard, os.getpid())
+    while True:
+        msg = tasks.get()
+        if msg is None:
+            return
+        cycle, shm_name, shape, names, lo, hi, min_eff, params = msg
+        _apply_shard_params(params)
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name)
+        except FileNotFoundError:
+            results.put((cycle, shard, None))
             continue
         try:
-            if client.has.get("fetchFundingRates"):
-                rates = await client.fetch_funding_rates()
-                if not rates or len(rates) < 10:
-                    logger.debug("Low/no funding rates for %s, skip", name)
-                    continue
-                out[name] = rates
-            await asyncio.sleep(0.2)
+            block = np.ndarray(shape, dtype=float, buffer=shm.buf)
+            store = {"exchanges": names, "ts": 0.0}
+            for i, f in enumerate(TICKER_FIELDS):
+                store[f] = block[i]
+            recs = cex_cex_scan(store, np.arange(lo, hi), min_eff)
+            del store, block
+            results.put((cycle, shard, recs))
         except Exception as e:
-            logger.debug("fetch_funding_rates %s error: %s", name, e)
+            logger.error("scan shard %d error: %s", shard, e)
+            results.put((cycle, shard, None))
+        finally:
+            shm.close()
+
+def start_shard_workers():
+    global SHARD_POOL
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    tasks = [ctx.Queue() for _ in range(SCAN_SHARDS)]
+    procs = [ctx.Process(target=shard_worker, args=(i, tasks[i], results), name=f"scan-shard-{i}", daemon=True)
+             for i in range(SCAN_SHARDS)]
+    for p in procs:
+        p.start()
+    SHARD_POOL = {"procs": procs, "tasks": tasks, "results": results, "cycle": 0}
+    logger.info("Started %d scan shards", SCAN_SHARDS)
+
+def stop_shard_workers():
+    global SHARD_POOL
+    pool, SHARD_POOL = SHARD_POOL, None
+    if pool is None:
+        return
+    for q in pool["tasks"]:
+        try:
+            q.put_nowait(None)
+        except Exception:
+            pass
+    for p in pool["procs"]:
+        p.join(timeout=5)
+        if p.is_alive():
+            p.terminate()
+
+async def restart_shard_workers():
+    # joining the old workers can take seconds: off the event loop
+    await asyncio.to_thread(stop_shard_workers)
+    start_shard_workers()
+
+async def sharded_cex_cex_scan(store: dict, min_eff: Optional[float] = None) -> Optional[np.ndarray]:
+    # None when the shards didn't all answer in time; the caller scans in-process instead
+    pool = SHARD_POOL
+    if pool is None:
+        return None
+    if not all(p.is_alive() for p in pool["procs"]):
+        logger.warning("scan shard died, restarting shards")
+        await restart_shard_workers()
+        pool = SHARD_POOL
+    pool["cycle"] += 1
+    cycle = pool["cycle"]
+    block_shape = (len(TICKER_FIELDS),) + store["bid"].shape
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(block_shape)) * 8))
+    try:
+        block = np.ndarray(block_shape, dtype=float, buffer=shm.buf)
+        for i, f in enumerate(TICKER_FIELDS):
+            block[i] = store[f]
+        del block
+        params = _shard_params()
+        # workers read MIN_EFF_SPREAD_PERCENT at import: send the coordinator's current threshold
+        threshold = MIN_EFF_SPREAD_PERCENT if min_eff is None else min_eff
+        bounds = np.linspace(0, store["bid"].shape[0], len(pool["tasks"]) + 1).astype(int)
+        for i, q in enumerate(pool["tasks"]):
+            q.put((cycle, shm.name, block_shape, store["exchanges"], int(bounds[i]), int(bounds[i + 1]), threshold, params))
+        parts: List[np.ndarray] = []
+        deadline = time.monotonic() + SHARD_TIMEOUT
+        pending = len(pool["tasks"])
+        while pending:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                logger.warning("scan shards timed out after %.0fs", SHARD_TIMEOUT)
+                # a worker that missed the deadline may be stuck: start over with fresh workers
+                await restart_shard_workers()
+                return None
+            try:
+                got_cycle, shard, recs = await asyncio.to_thread(pool["results"].get, True, min(left, 1.0))
+            except Exception:
+                continue  # queue.Empty: keep waiting until the deadline
+            if got_cycle != cycle:
+                continue  # late answer from an earlier cycle
+            if recs is None:
+                return None
+            parts.append(recs)
+            pending -= 1
+    finally:
+        shm.close()
+        shm.unlink()
+    recs = np.concatenate(parts) if parts else np.zeros((0, 10))
+    return recs[np.argsort(-recs[:, 8], kind="stable")] if len(recs) else recs
+
+# ---------------- triangular arbitrage ----------------
+# Every spot pair of a venue is an edge both ways: base→quote sells at the bid, quote→base
+# buys at the ask. The 3-cycles through each anchor are enumerated once per market list;
+# each fetch then prices all of them in one vectorized pass.
+def build_cycle_index(pairs: List[str], anchors: List[str]) -> dict:
+    # {"legs": pair index [k, 3], "sell": leg sells at the bid [k, 3], "path": [(anchor, x, y), ...]}
+    adj: Dict[str, List[Tuple[str, int, bool]]] = {}
+    edge: Dict[Tuple[str, str], Tuple[int, bool]] = {}
+    for i, sym in enumerate(pairs):
+        base, _, quote = sym.partition("/")
+        adj.setdefault(base, []).append((quote, i, True))
+        adj.setdefault(quote, []).append((base, i, False))
+        edge[(base, quote)] = (i, True)
+        edge[(quote, base)] = (i, False)
+    legs: List[Tuple[int, int, int]] = []
+    sell: List[Tuple[bool, bool, bool]] = []
+    path: List[Tuple[str, str, str]] = []
+    for a in anchors:
+        for x, p1, s1 in adj.get(a, ()):
+            for y, p2, s2 in adj.get(x, ()):
+                back = edge.get((y, a))
+                if y == a or back is None:
+                    continue
+                legs.append((p1, p2, back[0])); sell.append((s1, s2, back[1])); path.append((a, x, y))
+    return {"legs": np.array(legs, dtype=np.int64).reshape(-1, 3), "sell": np.array(sell, dtype=bool).reshape(-1, 3), "path": path}
+
+def update_cross_book(name: str, tks: Dict[str, dict]):
+    _, include, exclude = market_filter(name)
+    pairs: List[str] = []
+    vals: List[tuple] = []
+    for sym, t in tks.items():
+        if not t or ":" in sym or "/" not in sym:
+            continue
+        if include and not any(fnmatch.fnmatchcase(sym, p) for p in include):
+            continue
+        if exclude and any(fnmatch.fnmatchcase(sym, p) for p in exclude):
+            continue
+        last = t.get("last")
+        pairs.append(sym)
+        vals.append((t.get("bid"), t.get("ask"), last, t.get("quoteVolume") or (t.get("baseVolume") or 0) * (last or 0)))
+    arr = np.array(vals, dtype=float).reshape(-1, 4)
+    book = CROSS_BOOK.get(name)
+    if book is not None and book["pairs"] == pairs:
+        index = book["index"]
+    else:
+        t0 = time.perf_counter()
+        index = build_cycle_index(pairs, TRI_ANCHORS)
+        logger.info("Triangular index %s: %d pairs, %d cycles (%.0f ms)", name, len(pairs), len(index["path"]), (time.perf_counter() - t0) * 1000)
+    # leg volumes in USD via each quote currency's price against USDT
+    usd = {"USDT": 1.0}
+    for i, sym in enumerate(pairs):
+        base, _, quote = sym.partition("/")
+        if quote == "USDT" and arr[i, 2] > 0:
+            usd[base] = arr[i, 2]
+    quote_usd = np.array([usd.get(sym.partition("/")[2], np.nan) for sym in pairs])
+    CROSS_BOOK[name] = {"ts": time.time(), "pairs": pairs, "bid": arr[:, 0], "ask": arr[:, 1],
+                        "qvol_usd": arr[:, 3] * quote_usd, "index": index}
+
+def triangular_best(book: dict, fee_pct: float, min_profit: float) -> List[Tuple[int, float, float]]:
+    # (cycle, profit %, smallest leg volume USD), best first
+    idx = book["index"]
+    legs, sell = idx["legs"], idx["sell"]
+    if not len(legs):
+        return []
+    bid, ask = book["bid"][legs], book["ask"][legs]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rate = np.where(sell, bid, 1.0 / ask)
+        profit = (rate.prod(axis=1) * (1 - fee_pct / 100) ** 3 - 1) * 100
+    vol = np.nan_to_num(book["qvol_usd"][legs], nan=0.0).min(axis=1)
+    ok = np.flatnonzero(np.isfinite(profit) & (profit >= min_profit) & (vol >= TRI_MIN_VOLUME_USD)
+                        & (bid > 0).all(axis=1) & (ask > 0).all(axis=1))
+    ok = ok[np.argsort(-profit[ok], kind="stable")]
+    return [(int(c), float(profit[c]), float(vol[c])) for c in ok]
+
+# ---------------- order book depth ----------------
+async def _fetch_order_book(key: Tuple[str,str]) -> Optional[dict]:
+    name, sym = key
+    client = exchange_client(name)
+    limit = ORDERBOOK_LIMITS[name]
+    book = None
+    try:
+        async with limit:
+            book = await asyncio.wait_for(client.fetch_order_book(sym, limit=DEPTH_LIMIT), timeout=TICKERS_FETCH_TIMEOUT)
+    except Exception as e:
+        logger.debug("fetch_order_book %s %s error: %s", name, sym, e)
+    now = time.time()
+    if len(ORDERBOOK_CACHE) > 2048:
+        for k in [k for k, (ts, _) in ORDERBOOK_CACHE.items() if now - ts >= ORDERBOOK_TTL]:
+            del ORDERBOOK_CACHE[k]
+    ORDERBOOK_CACHE[key] = (now, book)
+    return book
+
+async def get_order_book(name: str, sym: str) -> Optional[dict]:
+    key = (name, sym)
+    hit = ORDERBOOK_CACHE.get(key)
+    fresh = bool(hit) and time.time() - hit[0] < ORDERBOOK_TTL
+    cache_lookup("orderbook", fresh)
+    if fresh:
+        return hit[1]
+    task = ORDERBOOK_INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.create_task(_fetch_order_book(key))
+        ORDERBOOK_INFLIGHT[key] = task
+        task.add_done_callback(lambda _t: ORDERBOOK_INFLIGHT.pop(key, None))
+    return await asyncio.shield(task)
+
+def vwap_buy(asks: List[list], usd: float) -> Optional[Tuple[float, float]]:
+    # (average price, base qty) to spend usd walking up the asks; None if the book is too thin
+    if usd <= 0:
+        return None  # /capital 0: nothing to price
+    spent = qty = 0.0
+    for level in asks:
+        px, sz = float(level[0]), float(level[1])
+        if px <= 0:
+            continue
+        take = min(sz, (usd - spent) / px)
+        spent += take * px; qty += take
+        if spent >= usd * (1 - 1e-9):
+            return spent / qty, qty
+    return None
+
+def vwap_sell(bids: List[list], qty: float) -> Optional[float]:
+    # average price to sell qty walking down the bids; None if the book is too thin
+    if qty <= 0:
+        return None
+    got, left = 0.0, qty
+    for level in bids:
+        px, sz = float(level[0]), float(level[1])
+        take = min(sz, left)
+        got += take * px; left -= take
+        if left <= qty * 1e-9:
+            return got / qty
+    return None
+
+async def confirm_cex_cex_depth(cands: List[tuple]) -> List[tuple]:
+    # re-price cex_cex_opps rows at the executable VWAP for MY_CAPITAL_USD
+    books = await asyncio.gather(*(asyncio.gather(get_order_book(buy, sym), get_order_book(sell, sym))
+                                   for sym, buy, sell, *_ in cands))
+    out = []
+    for (sym, buy, sell, pb, ps, qb, qs, raw, eff, n), (book_b, book_s) in zip(cands, books):
+        if not book_b or not book_s:
+            continue
+        bought = vwap_buy(book_b.get("asks") or [], MY_CAPITAL_USD)
+        if not bought:
+            continue
+        buy_px, qty = bought
+        sell_px = vwap_sell(book_s.get("bids") or [], qty)
+        if not sell_px:
+            continue
+        exec_raw = (sell_px - buy_px) / buy_px * 100
+        exec_eff = effective_after_costs(exec_raw, True, buy, ex_name_b=sell, slippage_pct=0.0)
+        if exec_eff >= MIN_EFF_SPREAD_PERCENT:
+            out.append((sym, buy, sell, buy_px, sell_px, qb, qs, exec_raw, exec_eff, n))
+    out.sort(key=lambda r: r[8], reverse=True)
     return out
 
+async def cex_exec_price(name: str, sym: str, buy: bool, ref_price: float) -> Optional[float]:
+    # VWAP on one venue for MY_CAPITAL_USD: buying walks the asks, selling walks the bids
+    book = await get_order_book(name, sym)
+    if not book:
+        return None
+    if buy:
+        bought = vwap_buy(book.get("asks") or [], MY_CAPITAL_USD)
+        return bought[0] if bought else None
+    return vwap_sell(book.get("bids") or [], MY_CAPITAL_USD / ref_price)
+
 # ---------------- STRATEGY CHECKS ----------------
-async def check_cex_cex(tickers_by_ex: Dict[str,Dict[str,dict]]):
-    logger.info("Check CEX↔CEX")
-    names = list(tickers_by_ex.keys())
-    for i in range(len(names)):
-        for j in range(i+1, len(names)):
-            a = names[i]; b = names[j]
-            common = set(tickers_by_ex[a].keys()) & set(tickers_by_ex[b].keys())
-            for sym in common:
-                ta = tickers_by_ex[a].get(sym); tb = tickers_by_ex[b].get(sym)
-                if not ta or not tb: continue
-                qa = ta.get("quoteVolume",0); qb = tb.get("quoteVolume",0)
-                if qa < MIN_VOLUME_24H or qb < MIN_VOLUME_24H: continue
-                pa = ta.get("last"); pb = tb.get("last")
-                if pa is None or pb is None: continue
-                raw = pct_between(pa,pb)
-                eff = effective_after_costs(raw, True, a)
-                if eff >= MIN_EFF_SPREAD_PERCENT:
-                    profit = (eff/100.0)*MY_CAPITAL_USD
-                    direction = f"Купить → {a}, Продать → {b}" if pa < pb else f"Купить → {b}, Продать → {a}"
-                    msg = (
-                        f"🟢 <b>SPOT ARB</b>\n<code>{sym}</code>\n"
-                        f"raw: <b>{raw:.2f}%</b>  eff: <b>{eff:.2f}%</b>\n"
-                        f"{a}: <code>{pa:.6f}</code>\n{b}: <code>{pb:.6f}</code>\n"
-                        f"Объем(min): <b>{min(qa,qb)/1000:.1f}k</b> USDT\n"
-                        f"Направление: {direction}\n"
-                        f"Прогноз прибыли (на {MY_CAPITAL_USD}$): <b>${profit:.2f}</b>"
-                    )
-                    await safe_send_html(msg, dedup_key=f"spot_{sym}_{a}_{b}")
+async def check_cex_cex(store: dict, symbols: Optional[Set[str]] = None):
+    if symbols is None:
+        logger.info("Check CEX↔CEX")
+    rows = store_rows(store, symbols)
+    # cheap pass without the flat slippage estimate when the real books decide afterwards
+    min_eff = MIN_EFF_SPREAD_PERCENT - EST_SLIPPAGE_PCT if DEPTH_CHECK else None
+    with stage_timer("cex_cex_eval"):
+        recs = cex_cex_delta_scan(store, min_eff) if symbols is None else None
+        if recs is None and SHARD_POOL is not None and symbols is None:
+            recs = await sharded_cex_cex_scan(store, min_eff)
+        if recs is None:
+            recs = cex_cex_scan(store, rows, min_eff)
+            metric_inc("arb_delta_rows_total", len(rows), check="cex_cex", result="scanned")
+        if symbols is None:
+            CEX_CEX_CACHE.update(ts=store["ts"], params=(_shard_params(), min_eff, MIN_EFF_SPREAD_PERCENT),
+                                 exchanges=list(store["exchanges"]), recs=recs)
+        opps = cex_cex_opps(store, recs)
+    if DEPTH_CHECK:
+        with stage_timer("cex_cex_depth"):
+            opps = await confirm_cex_cex_depth(opps[:DEPTH_MAX_CANDIDATES])
+    for sym, buy, sell, pb, ps, qb, qs, raw, eff, n in opps:
+        profit = (eff/100.0)*MY_CAPITAL_USD
+        msg = (
+            f"🟢 <b>SPOT ARB</b>\n<code>{sym}</code>\n"
+            f"raw: <b>{raw:.2f}%</b>  eff: <b>{eff:.2f}%</b>\n"
+            f"{buy}: <code>{pb:.6f}</code>\n{sell}: <code>{ps:.6f}</code>\n"
+            + (f"Цены: VWAP по стакану на {MY_CAPITAL_USD}$\n" if DEPTH_CHECK else "") +
+            f"Объем(min): <b>{min(qb,qs)/1000:.1f}k</b> USDT\n"
+            f"Направление: Купить → {buy}, Продать → {sell} (бирж: {n})\n"
+            f"Прогноз прибыли (на {MY_CAPITAL_USD}$): <b>${profit:.2f}</b>"
+        )
+        queue_alert(msg, dedup_key=f"spot_{sym}_{buy}_{sell}")
 
 async def check_funding():
-    logger.info("Check FUNDING")
-    funding = await build_funding_snapshot()
-    if not funding:
+    global FUNDING_CHECKED_TS
+    funding, snap_ts = FUNDING_SNAPSHOT, FUNDING_SNAPSHOT_TS
+    if not funding or snap_ts <= FUNDING_CHECKED_TS:
+        return  # nothing new since the last evaluation
+    if time.time() - snap_ts > 3 * FUNDING_CHECK_INTERVAL:
+        logger.warning("Funding snapshot is stale (%.0fs), skip", time.time() - snap_ts)
         return
-    exs = list(funding.keys())
-    for i in range(len(exs)):
-        for j in range(i+1, len(exs)):
-            a = exs[i]; b = exs[j]
-            common = set(funding[a].keys()) & set(funding[b].keys())
-            for perp in common:
-                try:
-                    ra = float(funding[a][perp].get("fundingRate",0))*100
-                    rb = float(funding[b][perp].get("fundingRate",0))*100
-                    spread = abs(ra - rb)
-                    # convert to percent and compare to threshold (we require eff >= MIN_EFF_SPREAD_PERCENT)
-                    # approximate: use spread as raw_pct for funding check but require higher than 0.02 (2bp) for notifying funding deltas
-                    if spread*1.0 < 0.05:  # require at least 0.05% funding diff to consider
-                        continue
-                    # profit estimation (rough)
-                    profit = (spread/100.0) * MY_CAPITAL_USD
-                    if profit < 0.5:
-                        continue
-                    msg = (
-                        f"🟣 <b>FUNDING ARB</b>\n<code>{perp}</code>\n"
-                        f"{a}: {ra:.4f}%\n{b}: {rb:.4f}%\n"
-                        f"Δ funding: <b>{spread:.3f}%</b>\n"
-                        f"Прогноз прибыли (на {MY_CAPITAL_USD}$): <b>${profit:.2f}</b>"
-                    )
-                    await safe_send_html(msg, dedup_key=f"fund_{perp}_{a}_{b}")
-                except Exception:
-                    continue
+    FUNDING_CHECKED_TS = snap_ts
+    logger.info("Check FUNDING")
+    # one pass over all venues: lowest and highest rate per perp -> [lo_ex, lo, hi_ex, hi]
+    best: Dict[str, list] = {}
+    for ex, rates in funding.items():
+        for perp, fr in rates.items():
+            try:
+                r = float(fr.get("fundingRate",0))*100
+            except (TypeError, ValueError):
+                continue
+            b = best.get(perp)
+            if b is None:
+                best[perp] = [ex, r, ex, r]
+                continue
+            if r < b[1]:
+                b[0] = ex; b[1] = r
+            if r > b[3]:
+                b[2] = ex; b[3] = r
+    opps = []
+    for perp, (a, ra, b, rb) in best.items():
+        spread = rb - ra
+        if spread < 0.05:  # require at least 0.05% funding diff to consider
+            continue
+        # profit estimation (rough)
+        profit = (spread/100.0) * MY_CAPITAL_USD
+        if profit < 0.5:
+            continue
+        opps.append((spread, perp, a, ra, b, rb, profit))
+    opps.sort(key=lambda o: o[0], reverse=True)
+    for spread, perp, a, ra, b, rb, profit in opps:
+        msg = (
+            f"🟣 <b>FUNDING ARB</b>\n<code>{perp}</code>\n"
+            f"{a}: {ra:.4f}%\n{b}: {rb:.4f}%\n"
+            f"Δ funding: <b>{spread:.3f}%</b>\n"
+            f"Лонг → {a}, Шорт → {b}\n"
+            f"Прогноз прибыли (на {MY_CAPITAL_USD}$): <b>${profit:.2f}</b>"
+        )
+        queue_alert(msg, dedup_key=f"fund_{perp}_{a}_{b}")
 
-async def check_cex_dex(tickers_by_ex: Dict[str,Dict[str,dict]], session: aiohttp.ClientSession, dex_limit: int = 50):
+async def check_triangular():
+    now = time.time()
+    for name in enabled_exchanges():
+        book = CROSS_BOOK.get(name)
+        if book is None or now - book["ts"] > 2 * CHECK_INTERVAL_SECONDS:
+            continue
+        idx = book["index"]
+        for c, profit, vol in triangular_best(book, cex_fee_pct(name), TRI_MIN_PROFIT_PCT)[:TRI_MAX_ALERTS]:
+            a, x, y = idx["path"][c]
+            steps = []
+            for p, s in zip(idx["legs"][c], idx["sell"][c]):
+                sym = book["pairs"][p]
+                steps.append(f"{'Продать' if s else 'Купить'} {sym} @ <code>{(book['bid'][p] if s else book['ask'][p]):.8g}</code>")
+            msg = (
+                f"🟠 <b>TRIANGULAR {name.upper()}</b>\n"
+                f"{a} → {x} → {y} → {a}\n" + "\n".join(steps) + "\n"
+                f"Профит после комиссий: <b>{profit:.2f}%</b>\n"
+                f"Объем(min): <b>{vol/1000:.1f}k</b> USDT\n"
+                f"Прогноз прибыли (на {MY_CAPITAL_USD}$): <b>${profit / 100 * MY_CAPITAL_USD:.2f}</b>"
+            )
+            queue_alert(msg, dedup_key=f"tri_{name}_{a}_{x}_{y}")
+
+async def check_cex_dex(store: dict, session: aiohttp.ClientSession, dex_limit: int = 50):
     logger.info("Check CEX↔DEX")
+    names = store["exchanges"]
+    # venues switched off since the store was fetched are left out, like in cex_cex_scan
+    cols = [j for j, name in enumerate(names) if ENABLED_EXCHANGES.get(name, False)]
     # collect candidate symbols by highest volume
-    cand: Dict[str, float] = {}
-    for ex_name, tdict in tickers_by_ex.items():
-        for sym, t in tdict.items():
-            qvol = t.get("quoteVolume") or (t.get("baseVolume") or 0) * (t.get("last") or 0)
-            if qvol and qvol >= MIN_VOLUME_24H:
-                cand[sym] = max(cand.get(sym,0), float(qvol))
-    top = sorted(cand.items(), key=lambda x: x[1], reverse=True)[:dex_limit]
-    for sym, vol in top:
-        # check each exchange price vs dex
-        for ex_name, tdict in tickers_by_ex.items():
-            tk = tdict.get(sym)
-            if not tk: continue
-            cex_price = tk.get("last")
-            if cex_price is None: continue
-            dex_price = await get_dex_price(session, sym)
-            if dex_price is None: continue
-            raw = pct_between(float(cex_price), float(dex_price))
+    vol_by_row = np.nan_to_num(store["qvol"][:, cols], nan=0.0).max(axis=1) if cols else np.zeros(0)
+    cand_rows = np.flatnonzero(vol_by_row >= MIN_VOLUME_24H)
+    top_rows = cand_rows[np.argsort(-vol_by_row[cand_rows], kind="stable")][:dex_limit]
+    top = [(SYMBOLS[r], float(vol_by_row[r])) for r in top_rows]
+    # trade size in tokens comes from the CEX price; all candidates are priced in one pass
+    ref_prices: Dict[str, float] = {}
+    for r, (sym, _) in zip(top_rows, top):
+        lasts = store["last"][r, cols]
+        lasts = lasts[lasts > 0]
+        if len(lasts):
+            ref_prices[sym] = float(lasts.mean())
+    # each leg is priced in its own direction: selling into the pool, and buying out of it
+    syms = [sym for sym, _ in top]
+    with stage_timer("dex_quote"):
+        dex_sell, dex_buy = await asyncio.gather(quote_dex_prices(session, syms, ref_prices),
+                                                 quote_dex_prices(session, syms, ref_prices, buy=True))
+    record("dex", {"sell": dex_sell, "buy": dex_buy})
+    # (sym, vol, ex, cex_price, dex_price, chain) that pass the flat-cost filter
+    cands = []
+    slip_margin = EST_SLIPPAGE_PCT if DEPTH_CHECK else 0.0
+    for r, (sym, vol) in zip(top_rows, top):
+        sell_price = dex_sell.get(sym); buy_price = dex_buy.get(sym)
+        if sell_price is None and buy_price is None: continue
+        for j in cols:
+            ex_name = names[j]
+            # buy on the CEX at the ask and sell into the pool, or buy from the pool and sell at the bid
+            ask = store["ask"][r, j]; bid = store["bid"][r, j]
+            if sell_price is not None and ask > 0 and ask < sell_price:
+                cex_price = float(ask); dex_price = sell_price
+            elif buy_price is not None and bid > 0 and bid > buy_price:
+                cex_price = float(bid); dex_price = buy_price
+            else:
+                continue
+            raw = pct_between(cex_price, float(dex_price))
             if raw is None: continue
-            chain = "BNB" if ("BNB" in sym or "BUSD" in sym) else "ETH"
-            eff = effective_after_costs(raw, False, ex_name, chain_for_gas=chain)
-            if eff >= MIN_EFF_SPREAD_PERCENT:
-                profit = (eff/100.0)*MY_CAPITAL_USD
-                dex_name = "PancakeSwap" if chain=="BNB" else "Uniswap"
-                msg = (
-                    f"🔵 <b>{ex_name.upper()}↔DEX</b>\n<code>{sym}</code>\n"
-                    f"raw: <b>{raw:.2f}%</b> eff: <b>{eff:.2f}%</b>\n"
-                    f"{ex_name}: <code>{float(cex_price):.6f}</code>\n{dex_name}: <code>{float(dex_price):.6f}</code>\n"
-                    f"Объем: <b>{vol/1000:.1f}k</b> USDT\n"
-                    f"Прогноз прибыли (на {MY_CAPITAL_USD}$): <b>${profit:.2f}</b>"
-                )
-                await safe_send_html(msg, dedup_key=f"dex_{sym}_{ex_name}")
+            chain = "BSC" if ("BNB" in sym or "BUSD" in sym) else "ETH"
+            eff = effective_after_costs(raw, False, ex_name, chain_for_gas=chain, dex_fee_pct=0.0)
+            if eff >= MIN_EFF_SPREAD_PERCENT - slip_margin:
+                cands.append((eff, sym, vol, ex_name, cex_price, float(dex_price), chain))
+    cands.sort(key=lambda c: c[0], reverse=True)
+    if DEPTH_CHECK:
+        cands = cands[:DEPTH_MAX_CANDIDATES]
+        # CEX leg at the book VWAP: buy there when it's the cheap side, sell when it's the rich one
+        exec_prices = await asyncio.gather(*(cex_exec_price(ex_name, sym, cex_price < dex_price, cex_price)
+                                             for _, sym, _, ex_name, cex_price, dex_price, _ in cands))
+    else:
+        exec_prices = [c[4] for c in cands]
+    for (_, sym, vol, ex_name, _, dex_price, chain), cex_price in zip(cands, exec_prices):
+        if cex_price is None: continue
+        raw = pct_between(cex_price, dex_price)
+        if raw is None: continue
+        eff = effective_after_costs(raw, False, ex_name, chain_for_gas=chain, slippage_pct=0.0 if DEPTH_CHECK else None,
+                                    dex_fee_pct=0.0)
+        if eff >= MIN_EFF_SPREAD_PERCENT:
+            profit = (eff/100.0)*MY_CAPITAL_USD
+            dex_name = dex_route_label(sym, buy=cex_price > dex_price) or ("PancakeSwap" if chain=="BSC" else "Uniswap")
+            msg = (
+                f"🔵 <b>{ex_name.upper()}↔DEX</b>\n<code>{sym}</code>\n"
+                f"raw: <b>{raw:.2f}%</b> eff: <b>{eff:.2f}%</b>\n"
+                f"{ex_name}: <code>{cex_price:.6f}</code>\n{dex_name}: <code>{dex_price:.6f}</code>\n"
+                f"Объем: <b>{vol/1000:.1f}k</b> USDT\n"
+                f"Прогноз прибыли (на {MY_CAPITAL_USD}$): <b>${profit:.2f}</b>"
+            )
+            queue_alert(msg, dedup_key=f"dex_{sym}_{ex_name}")
+
+# ---------------- streaming market data ----------------
+# Each adapter turns a list of exchange market ids into subscribe payloads and a raw
+# text frame into (market_id, fields) updates. Fields use ccxt ticker keys.
+def _f(v) -> Optional[float]:
+    try:
+        return float(v) if v not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+def _chunks(items: List[str], n: int) -> List[List[str]]:
+    return [items[i:i+n] for i in range(0, len(items), n)]
+
+def _bybit_subscribe(ids: List[str]) -> List[dict]:
+    topics = [t for mid in ids for t in (f"tickers.{mid}", f"orderbook.1.{mid}")]
+    return [{"op": "subscribe", "args": chunk} for chunk in _chunks(topics, 10)]
+
+def _bybit_parse(raw: str) -> List[Tuple[str, dict]]:
+    msg = json.loads(raw)
+    topic = msg.get("topic") or ""
+    data = msg.get("data") or {}
+    if topic.startswith("tickers."):
+        return [(data.get("symbol"), {"last": _f(data.get("lastPrice")), "quoteVolume": _f(data.get("turnover24h")),
+                                      "baseVolume": _f(data.get("volume24h"))})]
+    if topic.startswith("orderbook.1."):
+        bids = data.get("b") or []; asks = data.get("a") or []
+        return [(data.get("s"), {"bid": _f(bids[0][0]) if bids else None, "ask": _f(asks[0][0]) if asks else None})]
+    return []
+
+def _mexc_subscribe(ids: List[str]) -> List[dict]:
+    return [{"method": "SUBSCRIPTION", "params": [f"spot@public.bookTicker.v3.api@{mid}" for mid in ids]}]
+
+def _mexc_parse(raw: str) -> List[Tuple[str, dict]]:
+    msg = json.loads(raw)
+    if not str(msg.get("c", "")).startswith("spot@public.bookTicker"):
+        return []
+    d = msg.get("d") or {}
+    return [(msg.get("s"), {"bid": _f(d.get("b")), "ask": _f(d.get("a"))})]
+
+def _bitget_subscribe(ids: List[str]) -> List[dict]:
+    args = [{"instType": "SPOT", "channel": "ticker", "instId": mid} for mid in ids]
+    return [{"op": "subscribe", "args": chunk} for chunk in _chunks(args, 50)]
+
+def _bitget_parse(raw: str) -> List[Tuple[str, dict]]:
+    if raw == "pong":
+        return []
+    msg = json.loads(raw)
+    if (msg.get("arg") or {}).get("channel") != "ticker":
+        return []
+    return [(d.get("instId"), {"last": _f(d.get("lastPr")), "bid": _f(d.get("bidPr")), "ask": _f(d.get("askPr")),
+                               "quoteVolume": _f(d.get("quoteVolume")), "baseVolume": _f(d.get("baseVolume"))})
+            for d in msg.get("data") or []]
+
+# max_ids: market ids per connection (mexc caps a connection at 30 subscriptions)
+WS_ADAPTERS = {
+    "bybit": {"subscribe": _bybit_subscribe, "parse": _bybit_parse, "ping": {"op": "ping"}, "ping_every": 20, "max_ids": 100},
+    "mexc": {"subscribe": _mexc_subscribe, "parse": _mexc_parse, "ping": {"method": "PING"}, "ping_every": 20, "max_ids": 30},
+    "bitget": {"subscribe": _bitget_subscribe, "parse": _bitget_parse, "ping": "ping", "ping_every": 25, "max_ids": 200},
+}
+
+def apply_stream_quote(name: str, sym: str, fields: dict):
+    book = LIVE_BOOK
+    if book is None or name not in book["exchanges"]:
+        return
+    sid = SYMBOL_IDS.get(sym)
+    if sid is None or sid >= book["bid"].shape[0]:
+        return
+    j = book["exchanges"].index(name)
+    changed = False
+    for k, v in fields.items():
+        if v is None:
+            continue
+        col = "qvol" if k == "quoteVolume" else k
+        if col in TICKER_FIELDS and book[col][sid, j] != v:
+            book[col][sid, j] = v
+            if col != "qvol":
+                changed = True
+    if changed:
+        STREAM_DIRTY.add(sym)
+        STREAM_WAKEUP.set()
+
+def invalidate_stream_quotes(name: str, syms: Iterable[str]):
+    book = LIVE_BOOK
+    if book is None or name not in book["exchanges"]:
+        return
+    rows = store_rows(book, syms)
+    j = book["exchanges"].index(name)
+    for f in ("bid", "ask", "last"):
+        book[f][rows, j] = np.nan
+
+def stream_universe(store: dict) -> Dict[str, Tuple[str, ...]]:
+    # symbols listed with enough volume on at least two venues, busiest first
+    qvol = np.nan_to_num(store["qvol"], nan=0.0)
+    busy = qvol >= MIN_VOLUME_24H
+    shared = np.flatnonzero(busy.sum(axis=1) >= 2)
+    shared = shared[np.argsort(-qvol[shared].max(axis=1), kind="stable")]
+    out: Dict[str, Tuple[str, ...]] = {}
+    for j, name in enumerate(store["exchanges"]):
+        if name not in WS_ADAPTERS:
+            continue
+        rows = shared[~np.isnan(store["bid"][shared, j]) | ~np.isnan(store["last"][shared, j])]
+        out[name] = tuple(SYMBOLS[r] for r in rows[:STREAM_MAX_SYMBOLS])
+    return out
+
+def seed_live_book(store: dict, universe: Dict[str, Iterable[str]]):
+    # start from the REST snapshot (fresh 24h volumes for every venue) and carry over
+    # streamed quotes, which are newer than anything REST returned; universe = venue -> streamed symbols
+    global LIVE_BOOK
+    live = {k: (v.copy() if isinstance(v, np.ndarray) else v) for k, v in store.items()}
+    # a REST bid/ask nothing streams would sit in the book, going stale, until the next refresh
+    unstreamed = np.ones(live["bid"].shape, dtype=bool)
+    for name, syms in universe.items():
+        if name in live["exchanges"]:
+            unstreamed[store_rows(live, syms), live["exchanges"].index(name)] = False
+    live["bid"][unstreamed] = np.nan
+    live["ask"][unstreamed] = np.nan
+    old = LIVE_BOOK
+    if old is not None:
+        n = min(old["bid"].shape[0], live["bid"].shape[0])
+        for name, syms in universe.items():
+            if name not in old["exchanges"] or name not in live["exchanges"]:
+                continue
+            oj = old["exchanges"].index(name); nj = live["exchanges"].index(name)
+            rows = store_rows(old, syms)
+            rows = rows[rows < n]
+            for f in ("bid", "ask", "last"):
+                vals = old[f][rows, oj]
+                keep = ~np.isnan(vals)
+                live[f][rows[keep], nj] = vals[keep]
+    LIVE_BOOK = live
+
+def _capture_frame(name: str, raw: str):
+    path = os.path.join(STREAM_CAPTURE_DIR, f"{name}.jsonl")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"t": time.time(), "data": raw}) + "\n")
+
+async def _ws_send(ws: aiohttp.ClientWebSocketResponse, payload):
+    if isinstance(payload, str):
+        await ws.send_str(payload)
+    else:
+        await ws.send_json(payload)
+
+async def _ws_pinger(ws: aiohttp.ClientWebSocketResponse, adapter: dict):
+    while not ws.closed:
+        await asyncio.sleep(adapter["ping_every"])
+        await _ws_send(ws, adapter["ping"])
+
+async def stream_exchange(session: aiohttp.ClientSession, name: str, id_to_sym: Dict[str, str]):
+    adapter = WS_ADAPTERS[name]
+    url = STREAM_WS_URLS[name]
+    backoff = 1.0
+    while True:
+        try:
+            async with session.ws_connect(url, receive_timeout=STREAM_RECV_TIMEOUT) as ws:
+                for payload in adapter["subscribe"](list(id_to_sym)):
+                    await _ws_send(ws, payload)
+                logger.info("Stream %s connected (%d symbols)", name, len(id_to_sym))
+                pinger = asyncio.create_task(_ws_pinger(ws, adapter))
+                backoff = 1.0
+                try:
+                    async for msg in ws:
+                        if msg.type != aiohttp.WSMsgType.TEXT:
+                            continue
+                        if STREAM_CAPTURE_DIR:
+                            _capture_frame(name, msg.data)
+                        try:
+                            updates = adapter["parse"](msg.data)
+                        except ValueError:
+                            continue
+                        for mid, fields in updates:
+                            sym = id_to_sym.get(mid)
+                            if sym:
+                                apply_stream_quote(name, sym, fields)
+                finally:
+                    pinger.cancel()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Stream %s error: %s", name, e)
+        # never evaluate against quotes frozen at disconnect time
+        invalidate_stream_quotes(name, id_to_sym.values())
+        logger.info("Stream %s reconnecting in %.0fs", name, backoff)
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 60.0)
+
+def update_streams(session: aiohttp.ClientSession, name: str, syms: Iterable[str],
+                   chunks: Dict[Tuple[str, ...], asyncio.Task]) -> Dict[Tuple[str, ...], asyncio.Task]:
+    # connections (keyed by their symbols) for one venue's stream universe: a connection whose
+    # symbols all stay keeps running, the rest of the universe is packed into new ones
+    max_ids = WS_ADAPTERS[name]["max_ids"]
+    markets = exchange_client(name).markets or {}
+    wanted = {sym for sym in syms if sym in markets}
+    kept = {chunk: t for chunk, t in chunks.items() if set(chunk) <= wanted and not t.done()}
+    # churn that only ever adds symbols would otherwise leave many part-filled connections
+    if len(kept) > -(-len(wanted) // max_ids):
+        kept = {}
+    for chunk, t in chunks.items():
+        if chunk not in kept:
+            t.cancel()
+    covered = {sym for chunk in kept for sym in chunk}
+    out = dict(kept)
+    for chunk in _chunks(sorted(wanted - covered), max_ids):
+        ids = {markets[sym]["id"]: sym for sym in chunk}
+        out[tuple(chunk)] = asyncio.create_task(stream_exchange(session, name, ids))
+    return out
+
+async def stream_evaluator():
+    while True:
+        await STREAM_WAKEUP.wait()
+        await asyncio.sleep(STREAM_EVAL_DEBOUNCE)
+        STREAM_WAKEUP.clear()
+        dirty = set(STREAM_DIRTY)
+        STREAM_DIRTY.clear()
+        if LIVE_BOOK is None:
+            continue
+        t0 = time.monotonic()
+        try:
+            # disabled venues are masked inside cex_cex_scan
+            with stage_timer("cex_cex_stream"):
+                await check_cex_cex(LIVE_BOOK, symbols=dirty)
+        except Exception as e:
+            logger.error("stream evaluator error: %s", e)
+        metric_observe("arb_cycle_seconds", time.monotonic() - t0, loop="stream")
+
+# ---------------- boot snapshots ----------------
+# Markets and the CoinGecko symbol index are kept as gzipped JSON so a restart can scan
+# straight away; both are revalidated in the background after boot.
+def _boot_path(name: str) -> str:
+    return os.path.join(BOOT_CACHE_DIR, f"{name}.json.gz")
+
+def read_boot_snapshot(name: str) -> Optional[dict]:
+    try:
+        with gzip.open(_boot_path(name), "rt", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("boot snapshot %s unreadable: %s", name, e)
+        return None
+
+def write_boot_snapshot(name: str, data: dict):
+    os.makedirs(BOOT_CACHE_DIR, exist_ok=True)
+    path = _boot_path(name)
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"), default=str)
+    os.replace(path + ".tmp", path)
+
+def load_boot_snapshots() -> List[str]:
+    global COINGECKO_SYMBOL_TO_ID
+    # clients for the enabled venues only; exchange_client() applies their markets snapshot
+    for name in enabled_exchanges():
+        exchange_client(name)
+    warm = [name for name in enabled_exchanges() if name in MARKETS_WARM]
+    ids = read_boot_snapshot("coingecko_ids")
+    if ids:
+        COINGECKO_SYMBOL_TO_ID = ids
+    logger.info("Boot snapshots: markets %s, CoinGecko index %s", ", ".join(warm) or "none",
+                f"{len(ids)} symbols" if ids else "missing")
+    return warm
+
+async def refresh_markets(name: str, reload: bool):
+    client = exchange_client(name)
+    started = time.monotonic()
+    try:
+        # cold venues share the load already triggered by their first fetch_tickers()
+        await client.load_markets(reload=reload)
+        await asyncio.to_thread(write_boot_snapshot, f"markets_{name}", {"markets": client.markets, "currencies": client.currencies})
+        logger.info("Markets %s revalidated (%d markets, %.2fs)", name, len(client.markets or {}), time.monotonic() - started)
+    except Exception as e:
+        logger.warning("load_markets %s error: %s", name, e)
+
+async def revalidate_boot_snapshots(warm: List[str]):
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(refresh_markets(n, n in warm) for n in enabled_exchanges()), refresh_coingecko_index(session))
+    startup_phase("boot snapshots revalidated")
+
+# ---------------- recorder ----------------
+# Append-only segments of {"t", "kind", "data"} lines; each record is its own gzip member,
+# so a segment stays readable up to the last complete record after a crash.
+RECORD_KINDS = ("tickers", "funding", "dex", "gas")  # what record() accepts and replay.py reads
+
+def encode_ticker_store(store: dict) -> dict:
+    # rows with at least one quote only; symbols travel by name, not interned id
+    rows = np.flatnonzero(np.isfinite(store["bid"]).any(axis=1) | np.isfinite(store["last"]).any(axis=1))
+    out = {"exchanges": store["exchanges"], "symbols": [SYMBOLS[r] for r in rows]}
+    for f in TICKER_FIELDS:
+        out[f] = store[f][rows].tolist()
+    return out
+
+def decode_ticker_store(data: dict, ts: float) -> dict:
+    ids = np.array([intern_symbol(sym) for sym in data["symbols"]], dtype=np.int64)
+    store = new_ticker_store(data["exchanges"], ts)
+    for f in TICKER_FIELDS:
+        if len(ids):
+            store[f][ids] = np.array(data[f], dtype=float)
+    return store
+
+def record(kind: str, data, ts: Optional[float] = None):
+    if kind not in RECORD_KINDS:
+        raise ValueError(f"unknown record kind {kind!r}")
+    if not RECORD_DIR:
+        return
+    try:
+        RECORD_QUEUE.put_nowait((kind, ts or time.time(), data))
+    except asyncio.QueueFull:
+        logger.warning("recorder queue full, dropping %s snapshot", kind)
+
+def _record_write(path: str, kind: str, ts: float, data):
+    if kind == "tickers":
+        data = encode_ticker_store(data)
+    line = json.dumps({"t": ts, "kind": kind, "data": data}, separators=(",", ":"), default=str)
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+async def recorder_service():
+    os.makedirs(RECORD_DIR, exist_ok=True)
+    path, opened = None, 0.0
+    while True:
+        kind, ts, data = await RECORD_QUEUE.get()
+        if path is None or ts - opened >= RECORD_SEGMENT_SECONDS:
+            opened = ts
+            path = os.path.join(RECORD_DIR, f"{datetime.fromtimestamp(ts):%Y%m%d-%H%M%S}.jsonl.gz")
+            logger.info("Recording to %s", path)
+        try:
+            await asyncio.to_thread(_record_write, path, kind, ts, data)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("recorder write error (%s): %s", kind, e)
 
 # ---------------- Telegram command handlers ----------------
 async def cmd_capital(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -427,8 +2370,16 @@ async def cmd_enable(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Использование: /enable bybit")
         return
     ex = context.args[0].lower()
-    if ex in ENABLED_EXCHANGES:
+    if register_exchange(ex):
+        try:
+            exchange_client(ex)
+        except Exception as e:
+            logger.warning("client %s error: %s", ex, e)
+            await update.message.reply_text(f"Не удалось подключить {ex}: {e}")
+            return
         ENABLED_EXCHANGES[ex] = True
+        # markets load in the background; the next scan picks the venue up
+        asyncio.create_task(refresh_markets(ex, ex in MARKETS_WARM))
         await update.message.reply_text(f"✅ Биржа {ex} включена")
     else:
         await update.message.reply_text(f"Неизвестная биржа: {ex}")
@@ -440,27 +2391,140 @@ async def cmd_disable(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ex = context.args[0].lower()
     if ex in ENABLED_EXCHANGES:
         ENABLED_EXCHANGES[ex] = False
+        await release_exchange_client(ex)
         await update.message.reply_text(f"⛔ Биржа {ex} отключена")
     else:
         await update.message.reply_text(f"Неизвестная биржа: {ex}")
 
 async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ex_status = "\n".join([f"{k}: {'ON' if v else 'OFF'}" for k,v in ENABLED_EXCHANGES.items()])
-    await update.message.reply_text(f"📊 Капитал: ${MY_CAPITAL_USD}\nАктивные биржи:\n{ex_status}")
+    missing = f"\nНет данных в последнем цикле: {', '.join(SNAPSHOT_MISSING)}" if SNAPSHOT_MISSING else ""
+    jobs = ", ".join(f"{name} {job['interval']:.0f}s" for name, job in SCHEDULE.items())
+    cadence = f"\nИнтервалы: {jobs} (×{SPREAD_VOL['factor']:.2f})" if jobs else ""
+    await update.message.reply_text(f"📊 Капитал: ${MY_CAPITAL_USD}\nАктивные биржи:\n{ex_status}{missing}{cadence}")
+
+async def cmd_perf(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global PERF_PROFILE_NEXT
+    if context.args and context.args[0].lower() == "profile":
+        PERF_PROFILE_NEXT = True
+        await update.message.reply_text(f"🧪 Следующий цикл будет записан в cProfile ({PERF_PROFILE_DIR or 'profiles'}/)")
+        return
+    if not PERF_STAGES:
+        await update.message.reply_text("Замеры стадий выключены (PERF_STAGES=0)")
+        return
+    rows = perf_report()
+    if not rows:
+        await update.message.reply_text("Пока нет замеров")
+        return
+    lines = [f"{name:<16}{n:>5}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}" for name, n, p50, p95, p99 in rows]
+    header = f"{'стадия':<16}{'n':>5}{'p50':>9}{'p95':>9}{'p99':>9}"
+    await update.message.reply_text("⏱ <b>Стадии цикла, мс</b>\n<pre>" + "\n".join([header] + lines) + "</pre>", parse_mode="HTML")
+
+# ---------------- scheduler ----------------
+# Each data source / check is a named job with its own cadence and deadline. A job still
+# running when its next slot comes up is skipped, not queued; adaptive jobs speed up when
+# cross-venue spreads move more than usual and slow down when markets are quiet.
+def schedule_job(name: str, fn, interval: float, deadline: Optional[float] = None, adaptive: bool = False):
+    SCHEDULE[name] = {"fn": fn, "base": float(interval), "interval": float(interval), "deadline": float(deadline or interval),
+                      "adaptive": adaptive, "next": time.monotonic(), "started": 0.0, "task": None, "runs": 0, "skips": 0, "overruns": 0}
+    metric_set("arb_job_interval_seconds", float(interval), job=name)
+    SCHEDULE_WAKEUP.set()
+
+async def _run_job(name: str, job: dict):
+    t0 = time.monotonic()
+    try:
+        await asyncio.wait_for(job["fn"](), timeout=job["deadline"])
+    except asyncio.TimeoutError:
+        job["overruns"] += 1
+        metric_inc("arb_job_overruns_total", job=name)
+        logger.warning("job %s missed its %.0fs deadline", name, job["deadline"])
+    except Exception as e:
+        logger.error("job %s error: %s", name, e)
+    job["runs"] += 1
+    metric_observe("arb_job_seconds", time.monotonic() - t0, job=name)
+
+async def run_scheduler():
+    try:
+        while True:
+            now = time.monotonic()
+            for name, job in SCHEDULE.items():
+                if job["next"] > now:
+                    continue
+                task = job["task"]
+                if task is not None and not task.done():
+                    job["skips"] += 1
+                    metric_inc("arb_job_skips_total", job=name)
+                    logger.info("job %s still running, skipping this slot", name)
+                else:
+                    job["started"] = now
+                    job["task"] = asyncio.create_task(_run_job(name, job))
+                # fixed-rate slots; after a stall, restart from now instead of bursting
+                job["next"] += job["interval"]
+                if job["next"] <= now:
+                    job["next"] = now + job["interval"]
+            SCHEDULE_WAKEUP.clear()
+            wake = min((job["next"] for job in SCHEDULE.values()), default=now + 60)
+            try:
+                await asyncio.wait_for(SCHEDULE_WAKEUP.wait(), timeout=max(0.0, wake - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        for job in SCHEDULE.values():
+            if job["task"] is not None:
+                job["task"].cancel()
+
+def spread_volatility(store: dict) -> Optional[float]:
+    # mean absolute change of each liquid symbol's best cross-venue spread (%) since the
+    # previous store, per sqrt(minute) so faster polling doesn't read as a calmer market
+    bid, ask = store["bid"], store["ask"]
+    live = np.nan_to_num(store["qvol"], nan=0.0) >= MIN_VOLUME_24H
+    hi = np.where(live & (bid > 0), bid, -np.inf).max(axis=1, initial=-np.inf)
+    lo = np.where(live & (ask > 0), ask, np.inf).min(axis=1, initial=np.inf)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        spread = (hi - lo) / ((hi + lo) / 2) * 100
+    spread[~np.isfinite(spread)] = np.nan
+    prev, prev_ts = SPREAD_VOL["prev"], SPREAD_VOL["prev_ts"]
+    SPREAD_VOL["prev"], SPREAD_VOL["prev_ts"] = spread, store["ts"]
+    if prev is None or store["ts"] <= prev_ts:
+        return None
+    n = min(len(prev), len(spread))
+    moves = np.abs(spread[:n] - prev[:n])
+    moves = moves[np.isfinite(moves)]
+    if not len(moves):
+        return None
+    return float(moves.mean()) / np.sqrt((store["ts"] - prev_ts) / 60.0)
+
+def adapt_cadence(store: dict):
+    vol = spread_volatility(store)
+    if vol is None:
+        return
+    ewma = SPREAD_VOL["ewma"]
+    SPREAD_VOL["ewma"] = vol if ewma is None else ewma + SPREAD_VOL_ALPHA * (vol - ewma)
+    if not ADAPTIVE_CADENCE or not ewma or vol <= 0:
+        return
+    # twice the usual volatility -> half the interval, within the configured bounds
+    factor = float(np.clip(ewma / vol, CADENCE_MIN_FACTOR, CADENCE_MAX_FACTOR))
+    SPREAD_VOL["factor"] = factor
+    metric_set("arb_spread_volatility", vol)
+    metric_set("arb_cadence_factor", factor)
+    for name, job in SCHEDULE.items():
+        if not job["adaptive"]:
+            continue
+        job["interval"] = job["base"] * factor
+        job["next"] = min(job["next"], job["started"] + job["interval"])
+        metric_set("arb_job_interval_seconds", job["interval"], job=name)
+    SCHEDULE_WAKEUP.set()
 
 # ---------------- scheduler: morning capital prompt ----------------
 async def morning_prompt():
     # sends at 08:00 every day (server local time)
     while True:
         now = datetime.now()
-        if now.hour == 8 and now.minute == 0:
-            try:
-                await safe_send_html("☀️ <b>Доброе утро!</b>\nПожалуйста, отправь актуальный капитал командой /capital <amount> (в $).")
-            except Exception as e:
-                logger.debug("morning send error: %s", e)
-            # wait 61 seconds to avoid multiple sends in the same minute
-            await asyncio.sleep(61)
-        await asyncio.sleep(20)
+        at = now.replace(hour=8, minute=0, second=0, microsecond=0)
+        if at <= now:
+            at += timedelta(days=1)
+        await asyncio.sleep((at - now).total_seconds())
+        queue_alert("☀️ <b>Доброе утро!</b>\nПожалуйста, отправь актуальный капитал командой /capital <amount> (в $).")
 
 # ---------------- main loop and bot startup ----------------
 async def run_telegram_app():
@@ -469,45 +2533,156 @@ async def run_telegram_app():
     app.add_handler(CommandHandler("enable", cmd_enable))
     app.add_handler(CommandHandler("disable", cmd_disable))
     app.add_handler(CommandHandler("status", cmd_status))
+    app.add_handler(CommandHandler("perf", cmd_perf))
     await app.initialize()
     await app.start()
     # start polling in background
     await app.updater.start_polling()
     return app
 
+def schedule_common_jobs(session: aiohttp.ClientSession):
+    # DEX, funding and gas jobs shared by the polling and streaming loops
+    async def dex_job():
+        store = LATEST_STORE
+        if store is None:
+            # first tickers aren't in yet: retry shortly rather than a whole slot later
+            SCHEDULE["dex"]["next"] = time.monotonic() + 5
+            SCHEDULE_WAKEUP.set()
+            return
+        if time.time() - store["ts"] > 2 * CHECK_INTERVAL_SECONDS:
+            return  # no fresh tickers to compare against
+        await timed_stage("cex_dex", check_cex_dex(store, session))
+
+    async def funding_job():
+        await refresh_funding_snapshot()
+        await timed_stage("funding_check", check_funding())
+
+    schedule_job("dex", dex_job, DEX_CHECK_INTERVAL, adaptive=True)
+    schedule_job("funding", funding_job, FUNDING_CHECK_INTERVAL, deadline=FUNDING_FETCH_TIMEOUT + 60)
+    schedule_job("gas", lambda: update_gas_fees(session), GAS_UPDATE_INTERVAL, deadline=60)
+
 async def arb_loop():
     async with aiohttp.ClientSession() as session:
-        # init coingecko & gas once
-        await init_coingecko(session)
-        await update_gas_fees(session)
-        last_funding = 0
-        while True:
-            try:
-                tickers = await build_tickers_snapshot()
-                # funding snapshot (less frequent)
-                if time.time() - last_funding > FUNDING_CHECK_INTERVAL:
-                    funding = await build_funding_snapshot()
-                    last_funding = time.time()
-                else:
-                    funding = {}
-                # run checks concurrently
+        first = True
+
+        async def spot_job():
+            global LATEST_STORE
+            nonlocal first
+            t0 = time.monotonic()
+            with cycle_profile(), stage_timer("cycle"):
+                with stage_timer("tickers_fetch"):
+                    tickers = await build_tickers_snapshot()
+                LATEST_STORE = tickers
+                adapt_cadence(tickers)
                 await asyncio.gather(
-                    check_cex_cex(tickers),
-                    check_cex_dex(tickers, session),
-                    check_funding()
+                    timed_stage("cex_cex", check_cex_cex(tickers)),
+                    timed_stage("triangular", check_triangular())
                 )
-            except Exception as e:
-                logger.error("arb loop error: %s", e)
-            await asyncio.sleep(CHECK_INTERVAL_SECONDS)
+            metric_observe("arb_cycle_seconds", time.monotonic() - t0, loop="rest")
+            if first:
+                startup_phase("first scan complete")
+                first = False
+
+        schedule_job("spot", spot_job, CHECK_INTERVAL_SECONDS, adaptive=True)
+        schedule_common_jobs(session)
+        await run_scheduler()
+
+async def stream_loop():
+    # CEX↔CEX runs off the live book as quotes change; REST keeps volumes and the stream
+    # universe fresh, and the DEX / funding jobs run on their own cadence
+    if STREAM_CAPTURE_DIR:
+        os.makedirs(STREAM_CAPTURE_DIR, exist_ok=True)
+    async with aiohttp.ClientSession() as session:
+        evaluator = asyncio.create_task(stream_evaluator())
+        universe: Dict[str, Set[str]] = {}
+        # venue -> {symbols of one connection: its task}
+        streams: Dict[str, Dict[Tuple[str, ...], asyncio.Task]] = {}
+
+        async def refresh_job():
+            global LATEST_STORE
+            t0 = time.monotonic()
+            with cycle_profile(), stage_timer("cycle"):
+                with stage_timer("tickers_fetch"):
+                    tickers = await build_tickers_snapshot()
+                LATEST_STORE = tickers
+                adapt_cadence(tickers)
+                await timed_stage("triangular", check_triangular())
+                new_universe = stream_universe(tickers)
+                # the universe is ranked by volume: only a change of membership reconnects
+                for name in set(universe) | set(new_universe):
+                    syms = set(new_universe.get(name, ()))
+                    if syms == universe.get(name, set()):
+                        continue
+                    if syms:
+                        streams[name] = update_streams(session, name, syms, streams.get(name, {}))
+                        universe[name] = syms
+                    else:
+                        for t in streams.pop(name, {}).values():
+                            t.cancel()
+                        universe.pop(name, None)
+                seed_live_book(tickers, {name: {sym for chunk in chunks for sym in chunk} for name, chunks in streams.items()})
+            metric_observe("arb_cycle_seconds", time.monotonic() - t0, loop="rest")
+
+        # the stream carries prices; REST only refreshes volumes, so it doesn't need to speed up
+        schedule_job("stream_refresh", refresh_job, CHECK_INTERVAL_SECONDS)
+        schedule_common_jobs(session)
+        try:
+            await run_scheduler()
+        finally:
+            evaluator.cancel()
+            for chunks in streams.values():
+                for t in chunks.values():
+                    t.cancel()
+
+async def handle_healthz(request: web.Request) -> web.Response:
+    if not SNAPSHOT_TS:
+        return web.Response(text="starting")
+    age = time.time() - SNAPSHOT_TS
+    limit = HEALTH_MAX_SNAPSHOT_AGE or 3 * CHECK_INTERVAL_SECONDS + TICKERS_FETCH_TIMEOUT
+    if age > limit:
+        return web.Response(status=503, text=f"stale: last snapshot {age:.0f}s ago")
+    return web.Response(text="ok")
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+async def start_http_server() -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/healthz", handle_healthz)
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", HTTP_PORT).start()
+    logger.info("HTTP /healthz and /metrics on :%d", HTTP_PORT)
+    return runner
+
+async def start_telegram():
+    await run_telegram_app()
+    startup_phase("telegram ready")
+    await bot.send_message(chat_id=USER_ID, text="✅ Бот запущен: мониторинг сигналов (SPOT / FUNDING / CEX↔DEX).")
 
 async def main():
     logger.info("Starting arb monitor (signals only).")
-    # load markets
-    await asyncio.gather(*(client.load_markets() for client in EXCHANGES.values()))
+    http = await start_http_server()
+    if SCAN_SHARDS > 0:
+        start_shard_workers()
+    # markets and the CoinGecko index come from the boot snapshot; the first scan
+    # doesn't wait for load_markets() or /coins/list
+    warm = load_boot_snapshots()
+    load_token_cache()
+    startup_phase("boot snapshots loaded")
+    background = [alert_sender(), revalidate_boot_snapshots(warm), token_cache_refresher()]
+    if RESERVE_MIRROR:
+        background.append(reserve_mirror_loop())
+    if RECORD_DIR:
+        background.append(recorder_service())
     # start telegram app + arb loop + morning prompt
-    tg_app = await run_telegram_app()
-    await bot.send_message(chat_id=USER_ID, text="✅ Бот запущен: мониторинг сигналов (SPOT / FUNDING / CEX↔DEX).")
-    await asyncio.gather(arb_loop(), morning_prompt())
+    try:
+        await asyncio.gather(start_telegram(), stream_loop() if STREAM_MODE else arb_loop(), morning_prompt(), *background)
+    finally:
+        stop_shard_workers()
+        await close_rpc_sessions()
+        await http.cleanup()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,209 @@
+# replay.py
+# Backtest the strategy checks on segments written with RECORD_DIR=<dir>.
+# Recorded cycles are fed through the same check_* functions as fast as they run;
+# alerts go to a collector (main.ALERT_SINK) instead of Telegram, and DEX prices
+# come from the recording instead of RPC.
+#
+#   python replay.py records/ --min-eff 1.5 --slippage 0.2 --fee mexc=0.1
+#   python replay.py records/20250101-*.jsonl.gz --episodes episodes.csv
+import os
+import csv
+import glob
+import gzip
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+os.environ.setdefault("TELEGRAM_TOKEN", "0:replay")  # main builds a Bot at import, never used here
+import main
+
+CHECK_PREFIXES = {"spot": "cex_cex", "dex": "cex_dex", "fund": "funding"}
+
+def segment_paths(inputs: List[str]) -> List[str]:
+    paths: List[str] = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(glob.glob(os.path.join(item, "*.jsonl.gz")))
+        else:
+            paths.extend(glob.glob(item))
+    # segment names are start timestamps, so name order is time order
+    return sorted(set(paths), key=os.path.basename)
+
+def read_records(paths: List[str]) -> Iterator[dict]:
+    for path in paths:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except (OSError, EOFError, ValueError) as e:
+            # a segment cut short by a crash: keep what was complete
+            logging.getLogger("replay").warning("%s: stopped early (%s)", path, e)
+
+class Collector:
+    # alerts per cycle and the episodes they form: a key is "live" from the first cycle
+    # it fires until the first cycle its check ran without it
+    def __init__(self):
+        self.cycle: set = set()
+        self.alerts = 0
+        self.open: Dict[str, Tuple[float, int]] = {}             # key -> (first seen, cycles)
+        self.episodes: List[Tuple[str, float, float, int]] = []  # (key, start, end, cycles)
+
+    def __call__(self, text: str, key: Optional[str]):
+        self.alerts += 1
+        if key:
+            self.cycle.add(key)
+
+    def close_cycle(self, t: float, ran: set):
+        for key in self.cycle:
+            start, n = self.open.get(key, (t, 0))
+            self.open[key] = (start, n + 1)
+        for key in [k for k in self.open if k not in self.cycle and CHECK_PREFIXES.get(k.split("_", 1)[0]) in ran]:
+            start, n = self.open.pop(key)
+            self.episodes.append((key, start, t, n))
+        self.cycle = set()
+
+    def finish(self, t: float):
+        for key, (start, n) in self.open.items():
+            self.episodes.append((key, start, t, n))
+        self.open = {}
+
+def install_stubs(collector: Collector) -> Dict[bool, Dict[str, float]]:
+    main.ALERT_SINK = collector
+    main.DEPTH_CHECK = False  # order books aren't recorded
+    main.RECORD_DIR = None    # don't re-record the replay
+    # recorded DEX prices keyed by direction: False = selling into the pool, True = buying from it
+    dex_prices: Dict[bool, Dict[str, float]] = {False: {}, True: {}}
+
+    async def quote_dex_prices(session, syms, ref_prices, buy=False):
+        return {sym: dex_prices[buy][sym] for sym in syms if sym in dex_prices[buy]}
+    main.quote_dex_prices = quote_dex_prices
+    return dex_prices
+
+async def run_cycle(store: dict, collector: Collector):
+    ran = {"cex_cex", "cex_dex"}
+    checked = main.FUNDING_CHECKED_TS
+    await main.check_cex_cex(store)
+    await main.check_cex_dex(store, None)
+    await main.check_funding()
+    if main.FUNDING_CHECKED_TS != checked:
+        ran.add("funding")
+    collector.close_cycle(store["ts"], ran)
+
+async def replay(paths: List[str], collector: Collector) -> Tuple[int, float, float]:
+    # (cycles, first ts, last ts)
+    dex_prices = install_stubs(collector)
+    pending: Optional[dict] = None
+    cycles = 0
+    first = last = 0.0
+    unknown: set = set()
+    for rec in read_records(paths):
+        kind, t, data = rec.get("kind"), float(rec.get("t", 0)), rec.get("data")
+        if kind not in main.RECORD_KINDS:
+            if kind not in unknown:
+                unknown.add(kind)
+                logging.getLogger("replay").warning("skipping records of unknown kind %r", kind)
+            continue
+        if kind == "tickers":
+            # a cycle's DEX quotes are recorded after its tickers: run the previous cycle now
+            if pending is not None:
+                await run_cycle(pending, collector)
+                cycles += 1
+            pending = main.decode_ticker_store(data, t)
+            # venues switched on with /enable while recording are off in exchanges.json
+            for name in pending["exchanges"]:
+                main.ENABLED_EXCHANGES[name] = True
+            main.mark_dirty(pending)
+            dex_prices[False].clear()
+            dex_prices[True].clear()
+            first = first or t
+            last = t
+        elif kind == "dex":
+            data = data or {}
+            if isinstance(data.get("sell"), dict) or isinstance(data.get("buy"), dict):
+                dex_prices[False].update(data.get("sell") or {})
+                dex_prices[True].update(data.get("buy") or {})
+            else:
+                # early recordings hold one base→quote price per symbol for both directions
+                dex_prices[False].update(data)
+                dex_prices[True].update(data)
+        elif kind == "gas":
+            data = dict(data or {})
+            if "BNB" in data:
+                data.setdefault("BSC", data.pop("BNB"))  # early recordings keyed BSC gas by coin
+            main.GAS_FEES_USD.update(data)
+        elif kind == "funding":
+            main.FUNDING_SNAPSHOT = {ex: {perp: {"fundingRate": r} for perp, r in rates.items()} for ex, rates in (data or {}).items()}
+            # check_funding() judges staleness against the wall clock
+            main.FUNDING_SNAPSHOT_TS = time.time()
+    if pending is not None:
+        await run_cycle(pending, collector)
+        cycles += 1
+    collector.finish(last)
+    return cycles, first, last
+
+def apply_overrides(args):
+    if args.min_eff is not None:
+        main.MIN_EFF_SPREAD_PERCENT = args.min_eff
+    if args.slippage is not None:
+        main.EST_SLIPPAGE_PCT = args.slippage
+    if args.fee_default is not None:
+        main.CEX_FEE_DEFAULT_PCT = args.fee_default
+    if args.capital is not None:
+        main.MY_CAPITAL_USD = args.capital
+    if args.min_volume is not None:
+        main.MIN_VOLUME_24H = args.min_volume
+    for item in args.fee:
+        ex, _, pct = item.partition("=")
+        main.CEX_FEES_OVERRIDE[ex.lower()] = float(pct)
+
+def report(collector: Collector, cycles: int, first: float, last: float, elapsed: float):
+    span_h = (last - first) / 3600 if last > first else 0.0
+    print(f"{cycles} cycles, {span_h:.1f}h of data replayed in {elapsed:.2f}s "
+          f"({cycles / elapsed if elapsed else 0:.0f} cycles/s); {collector.alerts} alerts, {len(collector.episodes)} episodes")
+    print(f"{'kind':<8}{'episodes':>9}{'keys':>7}{'cycles p50':>11}{'life p50 s':>11}{'life p90 s':>11}{'life max s':>11}")
+    for prefix in CHECK_PREFIXES:
+        eps = [e for e in collector.episodes if e[0].startswith(prefix + "_")]
+        if not eps:
+            print(f"{prefix:<8}{0:>9}")
+            continue
+        # an episode ends at the first cycle without it, so life is an upper bound
+        life = np.array([end - start for _, start, end, _ in eps])
+        n = np.array([c for *_, c in eps])
+        print(f"{prefix:<8}{len(eps):>9}{len({e[0] for e in eps}):>7}{np.median(n):>11.0f}"
+              f"{np.median(life):>11.0f}{np.percentile(life, 90):>11.0f}{life.max():>11.0f}")
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Replay recorded snapshots through the strategy checks")
+    p.add_argument("inputs", nargs="+", help="record directories or segment files / globs")
+    p.add_argument("--min-eff", type=float, help="MIN_EFF_SPREAD_PERCENT")
+    p.add_argument("--slippage", type=float, help="EST_SLIPPAGE_PCT")
+    p.add_argument("--fee-default", type=float, help="CEX_FEE_DEFAULT_PCT")
+    p.add_argument("--fee", action="append", default=[], help="per-exchange taker fee, e.g. mexc=0.1 (repeatable)")
+    p.add_argument("--capital", type=float, help="MY_CAPITAL_USD")
+    p.add_argument("--min-volume", type=float, help="MIN_VOLUME_24H")
+    p.add_argument("--episodes", help="write every signal episode to this CSV")
+    args = p.parse_args()
+    logging.getLogger("arb-bot").setLevel(logging.WARNING)
+    apply_overrides(args)
+    paths = segment_paths(args.inputs)
+    if not paths:
+        p.error("no segments found")
+    collector = Collector()
+    started = time.perf_counter()
+    cycles, first, last = asyncio.run(replay(paths, collector))
+    report(collector, cycles, first, last, time.perf_counter() - started)
+    if args.episodes:
+        with open(args.episodes, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["key", "start", "end", "seconds", "cycles"])
+            for key, start, end, n in sorted(collector.episodes, key=lambda e: e[1]):
+                w.writerow([key, f"{start:.0f}", f"{end:.0f}", f"{end - start:.0f}", n])
+
+if __name__ == "__main__":
+    main_cli()
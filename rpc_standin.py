@@ -0,0 +1,152 @@
+# rpc_standin.py
+# Local JSON-RPC stand-in for the on-chain path: answers Multicall3.aggregate3 over the
+# router / factory / pair / ERC20 calls the bot makes, plus the block and gas methods.
+# getAmountsOut doubles the amount per hop; any path through REVERT_TOKEN reverts.
+#
+#   python rpc_standin.py --port 8545
+#   ETH_RPC=http://127.0.0.1:8545 BSC_RPC=http://127.0.0.1:8545 python main.py
+#   python rpc_standin.py --check        # one aggregate3 per batch, None for a reverted call
+import os
+import sys
+import asyncio
+import argparse
+import logging
+from typing import Dict, List, Tuple
+
+from aiohttp import web
+from web3 import Web3
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+
+codec = Web3().codec
+REVERT_TOKEN = Web3.to_checksum_address("0x000000000000000000000000000000000000dEaD")
+
+def _selector(signature: str) -> bytes:
+    return bytes(Web3.keccak(text=signature)[:4])
+
+SEL_AGGREGATE3 = _selector("aggregate3((address,bool,bytes)[])")
+SEL_AMOUNTS_OUT = _selector("getAmountsOut(uint256,address[])")
+SEL_GET_PAIR = _selector("getPair(address,address)")
+SEL_RESERVES = _selector("getReserves()")
+SEL_BLOCK = _selector("getBlockNumber()")
+SEL_DECIMALS = _selector("decimals()")
+
+class StandIn:
+    def __init__(self, block: int = 1000):
+        self.block = block
+        self.calls: Dict[str, int] = {}   # method (or "aggregate3") -> requests served
+        self.batches: List[int] = []      # calls per aggregate3
+
+    def call(self, data: bytes) -> Tuple[bool, bytes]:
+        # (success, returnData) for one inner call
+        sel, args = data[:4], data[4:]
+        if sel == SEL_AMOUNTS_OUT:
+            amount, path = codec.decode(["uint256", "address[]"], args)
+            if REVERT_TOKEN.lower() in (p.lower() for p in path):
+                return False, b""
+            return True, codec.encode(["uint256[]"], [[amount * 2 ** i for i in range(len(path))]])
+        if sel == SEL_GET_PAIR:
+            a, b = codec.decode(["address", "address"], args)
+            if REVERT_TOKEN.lower() in (a.lower(), b.lower()):
+                return True, codec.encode(["address"], ["0x" + "0" * 40])
+            pair = Web3.keccak(hexstr=a[2:] + b[2:])[-20:].hex()
+            return True, codec.encode(["address"], [Web3.to_checksum_address("0x" + pair[-40:])])
+        if sel == SEL_RESERVES:
+            return True, codec.encode(["uint112", "uint112", "uint32"], [10 ** 24, 2 * 10 ** 24, 0])
+        if sel == SEL_BLOCK:
+            return True, codec.encode(["uint256"], [self.block])
+        if sel == SEL_DECIMALS:
+            return True, codec.encode(["uint8"], [18])
+        return False, b""
+
+    def eth_call(self, data: bytes) -> bytes:
+        if data[:4] != SEL_AGGREGATE3:
+            ok, out = self.call(data)
+            if not ok:
+                raise ValueError("execution reverted")
+            return out
+        (calls,) = codec.decode(["(address,bool,bytes)[]"], data[4:])
+        self.batches.append(len(calls))
+        self.calls["aggregate3"] = self.calls.get("aggregate3", 0) + 1
+        return codec.encode(["(bool,bytes)[]"], [[self.call(bytes(d)) for _, _, d in calls]])
+
+    def answer(self, req: dict) -> dict:
+        method, params = req.get("method"), req.get("params") or []
+        self.calls[method] = self.calls.get(method, 0) + 1
+        out = {"jsonrpc": "2.0", "id": req.get("id")}
+        try:
+            if method == "eth_call":
+                out["result"] = "0x" + self.eth_call(bytes.fromhex(params[0]["data"][2:])).hex()
+            elif method == "eth_blockNumber":
+                self.block += 1
+                out["result"] = hex(self.block)
+            elif method == "eth_getLogs":
+                out["result"] = []
+            elif method == "eth_gasPrice":
+                out["result"] = hex(3 * 10 ** 9)
+            elif method == "eth_feeHistory":
+                n = int(params[0], 16) if isinstance(params[0], str) else int(params[0])
+                out["result"] = {"oldestBlock": hex(self.block - n), "baseFeePerGas": [hex(20 * 10 ** 9)] * (n + 1),
+                                 "reward": [[hex(10 ** 9)]] * n, "gasUsedRatio": [0.5] * n}
+            elif method == "eth_chainId":
+                out["result"] = "0x1"
+            else:
+                out["error"] = {"code": -32601, "message": f"method {method} not supported"}
+        except Exception as e:
+            out["error"] = {"code": 3, "message": str(e)}
+        return out
+
+    def app(self) -> web.Application:
+        async def handler(request: web.Request):
+            body = await request.json()
+            if isinstance(body, list):
+                return web.json_response([self.answer(r) for r in body])
+            return web.json_response(self.answer(body))
+        app = web.Application()
+        app.router.add_post("/", handler)
+        return app
+
+async def run_check(quotes: int) -> bool:
+    # quotes issued together must reach the node as one aggregate3, the reverted one as None
+    stand_in = StandIn()
+    runner = web.AppRunner(stand_in.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    os.environ.setdefault("TELEGRAM_TOKEN", "0:standin")  # main builds a Bot at import, never used here
+    import main
+    main.RPC_URLS["ETH"] = f"http://127.0.0.1:{port}/"
+    try:
+        weth, usdt = main.TOKEN_MAP["WETH"]["eth"], main.TOKEN_MAP["USDT"]["eth"]
+        n = min(quotes, main.MULTICALL_BATCH_SIZE)
+        paths = [[weth, usdt]] * (n - 1) + [[weth, REVERT_TOKEN, usdt]]
+        results = await asyncio.gather(*(main.quote_amounts_out("ETH", main.UNISWAP_ROUTER, path, 10 ** 18 + i)
+                                         for i, path in enumerate(paths)))
+    finally:
+        await main.close_rpc_sessions()
+        await runner.cleanup()
+    ok_quotes = all(r == [10 ** 18 + i, 2 * (10 ** 18 + i)] for i, r in enumerate(results[:-1]))
+    checks = [
+        (f"{n} quotes in one aggregate3 eth_call", stand_in.calls.get("eth_call") == 1 and stand_in.batches == [n]),
+        ("each caller got its own amounts", ok_quotes),
+        ("reverted call came back as None", results[-1] is None),
+    ]
+    for label, passed in checks:
+        print(f"{'ok  ' if passed else 'FAIL'} {label}")
+    return all(passed for _, passed in checks)
+
+def main_cli():
+    p = argparse.ArgumentParser(description="Local JSON-RPC stand-in for Multicall3 / V2 router calls")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8545)
+    p.add_argument("--check", action="store_true", help="run the batching self-check against main.py and exit")
+    p.add_argument("--quotes", type=int, default=75, help="quotes issued by --check")
+    args = p.parse_args()
+    if args.check:
+        logging.getLogger("arb-bot").setLevel(logging.WARNING)
+        sys.exit(0 if asyncio.run(run_check(args.quotes)) else 1)
+    web.run_app(StandIn().app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,71 @@
+# ws_replay.py
+# Local websocket stand-in for STREAM_MODE: replays frames captured with
+# STREAM_CAPTURE_DIR=<dir> back to the bot, one endpoint per exchange.
+#
+#   python ws_replay.py captures/ --port 8765 --speed 10
+#   STREAM_MODE=1 STREAM_WS_URL_BYBIT=ws://127.0.0.1:8765/bybit python main.py
+import os
+import json
+import asyncio
+import argparse
+import logging
+from typing import List, Tuple
+
+from aiohttp import web
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+logger = logging.getLogger("ws-replay")
+
+def load_frames(path: str) -> List[Tuple[float, str]]:
+    frames = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                rec = json.loads(line)
+                frames.append((float(rec["t"]), rec["data"]))
+    return frames
+
+def make_handler(capture_dir: str, speed: float, loop_forever: bool):
+    async def handler(request: web.Request):
+        name = request.match_info["exchange"]
+        path = os.path.join(capture_dir, f"{name}.jsonl")
+        if not os.path.exists(path):
+            raise web.HTTPNotFound(text=f"no capture for {name}")
+        frames = load_frames(path)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        # wait for the client's subscribe payload, like a real venue would
+        await ws.receive()
+        logger.info("%s: replaying %d frames at %.1fx", name, len(frames), speed)
+        while not ws.closed:
+            prev = frames[0][0] if frames else 0.0
+            for t, data in frames:
+                if speed > 0:
+                    await asyncio.sleep(max(0.0, t - prev) / speed)
+                prev = t
+                if ws.closed:
+                    break
+                await ws.send_str(data)
+            if not loop_forever:
+                break
+        # keep the socket open so the bot doesn't treat the end of the tape as a disconnect
+        async for _ in ws:
+            pass
+        return ws
+    return handler
+
+def main():
+    p = argparse.ArgumentParser(description="Replay captured exchange websocket frames")
+    p.add_argument("capture_dir")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier, 0 = as fast as possible")
+    p.add_argument("--loop", action="store_true", help="restart the tape when it ends")
+    args = p.parse_args()
+    app = web.Application()
+    app.router.add_get("/{exchange}", make_handler(args.capture_dir, args.speed, args.loop))
+    web.run_app(app, host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()